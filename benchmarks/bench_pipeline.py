@@ -0,0 +1,237 @@
+import argparse
+import functools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.const import Constants  # noqa: E402
+
+MEDIA = {
+    'mp3': ['-c:a', 'libmp3lame', '-b:a', '192k', '-ar', '44100'],
+    'webm': ['-c:a', 'libopus', '-b:a', '128k', '-ar', '48000'],
+}
+
+FILTER_SETS = {
+    'none': lambda f: [],
+    'volume': lambda f: [f.VolumeFilter(0.5)],
+    'tempo': lambda f: [f.TempoFilter(1.25)],
+    'echo+tempo': lambda f: [f.DelayFilter(), f.TempoFilter(1.25)],
+}
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def generate_media(ffmpeg: str, directory: str, seconds: int) -> dict[str, str]:
+    files = {}
+    for ext, codec in MEDIA.items():
+        path = os.path.join(directory, f'bench.{ext}')
+        subprocess.run([ffmpeg, '-nostdin', '-loglevel', 'error', '-y', '-f', 'lavfi',
+                        '-i', f'sine=frequency=440:duration={seconds}', '-ac', '2', *codec, path], check=True)
+        files[ext] = path
+    return files
+
+
+def serve(directory: str) -> tuple[ThreadingHTTPServer, str]:
+    # media is served over local http so the real -reconnect input options stay in play
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def process_usage(pid: Optional[int]) -> tuple[Optional[float], Optional[int]]:
+    if pid is None:
+        return None, None
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/statm') as f:
+            rss = int(f.read().split()[1]) * PAGE_SIZE
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, rss
+    except (OSError, IndexError, ValueError):
+        return None, None
+
+
+def ffmpeg_pid(audio) -> Optional[int]:
+    process = getattr(audio._ffmpeg_audio, '_process', None)
+    return getattr(process, 'pid', None)
+
+
+def percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return ordered[min(int(len(ordered) * p), len(ordered) - 1)] * 1000
+
+    return {'p50_ms': pick(0.5), 'p90_ms': pick(0.9), 'p99_ms': pick(0.99), 'max_ms': ordered[-1] * 1000,
+            'mean_ms': statistics.fmean(ordered) * 1000}
+
+
+def read_counted(audio) -> tuple[bytes, bool]:
+    # a stall is told apart by the underrun counter, the dsp chain hands back its own copy of the silence frame
+    from classes.metrics import underruns
+    before = underruns.value
+    data = audio.read()
+    return data, underruns.value > before
+
+
+def read_frame(audio, deadline: float):
+    while time.perf_counter() < deadline:
+        data, stalled = read_counted(audio)
+        if not stalled:
+            return data
+    return b''
+
+
+def time_to_frame(audio, action) -> float:
+    start = time.perf_counter()
+    action()
+    read_frame(audio, start + Constants.READ_AHEAD_START_TIMEOUT)
+    return time.perf_counter() - start
+
+
+def bench_stream(url: str, filters: list, frames: int, paced_frames: int) -> dict:
+    from classes.source_managers.ffmpeg_audio import PlayableAudio, AudioMeta
+    from classes.source_managers import audiofilters
+
+    audio = PlayableAudio(url, meta_info=AudioMeta('bench', sample_rate=None))
+    result = {'time_to_first_frame_ms': time_to_frame(audio, lambda: audio.start(filters)) * 1000}
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    produced = underruns = 0
+    while produced < frames:
+        data, stalled = read_counted(audio)
+        if not data:
+            break
+        if stalled:
+            underruns += 1
+            continue
+        produced += 1
+    elapsed = time.perf_counter() - start
+    result['sustained_fps'] = produced / elapsed if elapsed else None
+    result['sustained_realtime_factor'] = produced * 0.02 / elapsed if elapsed else None
+    result['unpaced_underruns'] = underruns
+    result['python_cpu_s_per_audio_s'] = (time.process_time() - cpu_start) / (produced * 0.02) if produced else None
+
+    latencies = []
+    next_tick = time.perf_counter()
+    for _ in range(paced_frames):
+        next_tick += 0.02
+        t = time.perf_counter()
+        if not audio.read():
+            break
+        latencies.append(time.perf_counter() - t)
+        time.sleep(max(0.0, next_tick - time.perf_counter()))
+    result['read_latency'] = percentiles(latencies)
+
+    cpu, rss = process_usage(ffmpeg_pid(audio))
+    result['ffmpeg_cpu_s'] = cpu
+    result['ffmpeg_rss_bytes'] = rss
+    stats = getattr(audio._ffmpeg_audio, 'buffer_stats', None)
+    result['buffer'] = stats
+
+    result['seek_ms'] = time_to_frame(audio, lambda: audio.seek_to(5)) * 1000
+    result['set_filters_dsp_ms'] = time_to_frame(
+        audio, lambda: audio.set_filters(filters + [audiofilters.VolumeFilter(0.8)])) * 1000
+    result['set_filters_ffmpeg_ms'] = time_to_frame(
+        audio, lambda: audio.set_filters(filters + [audiofilters.TempoFilter(1.1)])) * 1000
+    audio.cleanup()
+    return result
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(current: dict, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    for name, result in current['results'].items():
+        old = baseline.get('results', {}).get(name)
+        if not old:
+            continue
+        for key in ('time_to_first_frame_ms', 'sustained_fps', 'seek_ms', 'set_filters_dsp_ms',
+                    'set_filters_ffmpeg_ms'):
+            if result.get(key) is not None and old.get(key):
+                change = (result[key] - old[key]) / old[key] * 100
+                print(f'{name:24} {key:24} {old[key]:10.2f} -> {result[key]:10.2f} ({change:+.1f}%)',
+                      file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark of the decode/filter/read pipeline')
+    parser.add_argument('--ffmpeg', default='ffmpeg')
+    parser.add_argument('--seconds', type=int, default=60, help='length of the generated test media')
+    parser.add_argument('--frames', type=int, default=1500, help='frames read for the sustained rate')
+    parser.add_argument('--paced-frames', type=int, default=250, help='frames read at the real 20ms cadence')
+    parser.add_argument('--read-ahead', type=float, default=Constants.READ_AHEAD_SECONDS)
+    parser.add_argument('--output', help='write json results to this file instead of stdout')
+    parser.add_argument('--compare', help='previous json results to print deltas against')
+    args = parser.parse_args()
+
+    Constants.FFMPEG_LOCATION = args.ffmpeg
+    Constants.FFMPEG_CONFIG['executable'] = args.ffmpeg
+    Constants.READ_AHEAD_SECONDS = args.read_ahead
+    Constants.AUDIO_CACHE_DIR = None
+    Constants.AUDIO_WORKERS = 0
+    Constants.AUDIO_OUTPUT = 'pcm'
+    # measured per stream: a shared decoder hides the ffmpeg process and its read-ahead buffer
+    Constants.BROADCAST = False
+    Constants.LOUDNESS_TARGET = None
+    from classes.source_managers import audiofilters
+
+    with tempfile.TemporaryDirectory() as directory:
+        files = generate_media(args.ffmpeg, directory, args.seconds)
+        server, base_url = serve(directory)
+        results = {}
+        try:
+            for ext, path in files.items():
+                for name, make_filters in FILTER_SETS.items():
+                    url = f'{base_url}/{os.path.basename(path)}'
+                    results[f'{ext}/{name}'] = bench_stream(url, make_filters(audiofilters), args.frames,
+                                                            args.paced_frames)
+        finally:
+            server.shutdown()
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'read_ahead': args.read_ahead,
+        'results': results,
+    }
+    if args.compare:
+        compare(report, args.compare)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from typing import Optional, Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from discord import VoiceClient  # noqa: E402
+
+from benchmarks.bench_pipeline import generate_media, serve, percentiles, PAGE_SIZE, process_usage  # noqa: E402
+from src.const import Constants  # noqa: E402
+
+FRAME = 0.02
+
+
+class FrameStats:
+    def __init__(self, late_threshold: float):
+        self.late_threshold = late_threshold
+        self.frames = 0
+        self.late = 0
+        self.lateness: list[float] = []
+        self._lock = threading.Lock()
+
+    def record(self, lateness: float):
+        with self._lock:
+            self.frames += 1
+            self.lateness.append(max(lateness, 0.0))
+            if lateness > self.late_threshold:
+                self.late += 1
+
+
+class FakeClient:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+
+class FakeChannel:
+    bitrate = 96000
+
+
+class FakeVoiceClient(VoiceClient):
+    # stands in for the gateway/UDP side: consumes read() on a real-time 20ms schedule like discord's AudioPlayer
+    def __init__(self, client: FakeClient, channel: FakeChannel):
+        self.client = client
+        self.channel = channel
+        self.loop = client.loop
+        self.stats: Optional[FrameStats] = None
+        self._source = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._ended = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+    @property
+    def source(self):
+        return self._source
+
+    def is_connected(self) -> bool:
+        return True
+
+    def is_playing(self) -> bool:
+        return self._thread is not None and not self._ended.is_set() and self._resumed.is_set()
+
+    def is_paused(self) -> bool:
+        return self._thread is not None and not self._ended.is_set() and not self._resumed.is_set()
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._resumed.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    async def disconnect(self, *, force: bool = False):
+        self.stop()
+
+    def play(self, source, *, after: Callable = None):
+        self._source = source
+        self._stopped = threading.Event()
+        self._ended = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(source, after, self._stopped, self._ended),
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self, source, after: Optional[Callable], stopped: threading.Event, ended: threading.Event):
+        error = None
+        deadline = time.perf_counter()
+        try:
+            while not stopped.is_set():
+                if not self._resumed.is_set():
+                    self._resumed.wait()
+                    deadline = time.perf_counter()
+                    continue
+                data = source.read()
+                self.stats.record(time.perf_counter() - deadline)
+                if not data:
+                    break
+                deadline += FRAME
+                delay = deadline - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        except Exception as e:
+            error = e
+        finally:
+            # same order as discord's AudioPlayer: the player counts as stopped, then after, then cleanup
+            ended.set()
+            if after and not stopped.is_set():
+                after(error)
+            source.cleanup()
+
+
+def make_player_class():
+    from classes.player import FFMPEGPlayer
+
+    class SimulatedPlayer(FFMPEGPlayer, FakeVoiceClient):
+        pass
+
+    return SimulatedPlayer
+
+
+async def measure_loop_lag(samples: list[float], stop: asyncio.Event, interval: float = 0.05):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+async def press_buttons(player, stop: asyncio.Event, interval: float):
+    from classes.source_managers import audiofilters
+    actions = [
+        lambda: player.set_filters(audiofilters.VolumeFilter(random.choice([0.5, 1.5]))),
+        lambda: player.set_filters(audiofilters.TempoFilter(random.choice([0.9, 1.1]))),
+        lambda: player.set_filters(),
+        player.next_track,
+        player.shuffle,
+    ]
+    while not stop.is_set():
+        await asyncio.sleep(random.uniform(interval / 2, interval * 1.5))
+        random.choice(actions)()
+
+
+def own_rss() -> Optional[int]:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return None
+
+
+async def run_step(guilds: int, urls: list[str], duration: float, args) -> dict:
+    from classes.source_managers.process_supervisor import supervisor
+    from classes.source_managers.track_ref import TrackRef
+
+    loop = asyncio.get_running_loop()
+    player_class = make_player_class()
+    stats = FrameStats(args.late_ms / 1000)
+    stop = asyncio.Event()
+    lag: list[float] = []
+    players = []
+    cpu_start = time.process_time()
+    for _ in range(guilds):
+        player = player_class(FakeClient(loop), FakeChannel())
+        player.stats = stats
+        refs = [TrackRef(url, os.path.basename(url), duration=args.seconds) for url in urls * args.queue_repeat]
+        random.shuffle(refs)
+        player.add_to_queue(*refs, start_playing=True)
+        players.append(player)
+    tasks = [loop.create_task(measure_loop_lag(lag, stop))]
+    if args.action_interval > 0:
+        tasks += [loop.create_task(press_buttons(p, stop, args.action_interval)) for p in players]
+    await asyncio.sleep(duration)
+    ffmpeg_cpu = 0.0
+    for pid in list(supervisor._live):
+        cpu, _ = process_usage(pid)
+        ffmpeg_cpu += cpu or 0
+    result = {
+        'guilds': guilds,
+        'frames': stats.frames,
+        'late_frames': stats.late,
+        'late_ratio': stats.late / stats.frames if stats.frames else None,
+        'frame_lateness': percentiles(stats.lateness),
+        'loop_lag': percentiles(lag),
+        'python_cpu_percent': (time.process_time() - cpu_start) / duration * 100,
+        'ffmpeg_cpu_s_live': ffmpeg_cpu,
+        'ffmpeg': supervisor.stats,
+        'python_rss_bytes': own_rss(),
+    }
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for player in players:
+        player.shutdown()
+    await asyncio.sleep(Constants.FFMPEG_TERMINATE_GRACE + 1)
+    return result
+
+
+async def run(args, urls: list[str]) -> list[dict]:
+    results = []
+    for guilds in args.guilds:
+        result = await run_step(guilds, urls, args.duration, args)
+        print(f"{guilds:5} guilds: late {result['late_frames']}/{result['frames']} frames, "
+              f"loop lag p99 {result['loop_lag'].get('p99_ms', 0):.1f} ms, "
+              f"cpu {result['python_cpu_percent']:.0f}%", file=sys.stderr)
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless multi-guild playback load simulator')
+    parser.add_argument('--ffmpeg', default='ffmpeg')
+    parser.add_argument('--guilds', type=lambda s: [int(i) for i in s.split(',')], default=[1, 5, 10, 25, 50])
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run each step')
+    parser.add_argument('--seconds', type=int, default=20, help='length of each generated track')
+    parser.add_argument('--queue-repeat', type=int, default=5, help='copies of the test media in each queue')
+    parser.add_argument('--action-interval', type=float, default=10,
+                        help='mean seconds between simulated button presses per guild, 0 disables them')
+    parser.add_argument('--late-ms', type=float, default=20, help='lateness that counts as a missed deadline')
+    parser.add_argument('--broadcast', action='store_true',
+                        help='let guilds playing the same url share one decoder, per-guild figures then no longer apply')
+    parser.add_argument('--output', help='write json results to this file instead of stdout')
+    args = parser.parse_args()
+
+    Constants.FFMPEG_LOCATION = args.ffmpeg
+    Constants.FFMPEG_CONFIG['executable'] = args.ffmpeg
+    Constants.AUDIO_CACHE_DIR = None
+    Constants.AUDIO_OUTPUT = 'pcm'
+    # every guild plays the same urls, only with --broadcast do they share decoders
+    Constants.BROADCAST = args.broadcast
+    Constants.LOUDNESS_TARGET = None
+
+    with tempfile.TemporaryDirectory() as directory:
+        files = generate_media(args.ffmpeg, directory, args.seconds)
+        server, base_url = serve(directory)
+        try:
+            urls = [f'{base_url}/{os.path.basename(path)}' for path in files.values()]
+            results = asyncio.run(run(args, urls))
+        finally:
+            server.shutdown()
+
+    text = json.dumps({'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from classes.source_managers.vk_manager import VkApi  # noqa: E402
+
+
+class StubAudioHandler(BaseHTTPRequestHandler):
+    # mimics VK's audio.get: paged items, a total count and an occasional rate-limit error
+    protocol_version = 'HTTP/1.1'
+    tracks = 1000
+    latency = 0.05
+    error_every = 0
+    requests = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        with self.lock:
+            StubAudioHandler.requests += 1
+            number = StubAudioHandler.requests
+        time.sleep(self.latency)
+        if url.path.rstrip('/').split('/')[-1] != 'audio.get':
+            body = {'error': {'error_code': 3, 'error_msg': 'Unknown method passed'}}
+        elif self.error_every and number % self.error_every == 0:
+            body = {'error': {'error_code': 6, 'error_msg': 'Too many requests per second'}}
+        else:
+            offset, count = int(params.get('offset', 0)), int(params.get('count', 100))
+            owner = params.get('owner_id') or params.get('user_id') or 1
+            items = [{'id': i, 'owner_id': owner, 'url': f'https://example.invalid/{i}.mp3', 'title': f'Track {i}',
+                      'artist': 'Stub', 'duration': 180}
+                     for i in range(offset, min(offset + count, self.tracks))]
+            body = {'response': {'count': self.tracks, 'items': items}}
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve() -> tuple[ThreadingHTTPServer, str]:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubAudioHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/method'
+
+
+async def load(base_url: str, page_size: int, concurrency: int, rate: float, playlists: int) -> dict:
+    api = VkApi('stub', base_url=base_url, concurrency=concurrency, rate=rate, backoff=0.05)
+    StubAudioHandler.requests = 0
+    started = time.perf_counter()
+    first_page = None
+    count = 0
+    try:
+        async for page in api.iter_audio({'user_id': 1}, page_size):
+            first_page = first_page or time.perf_counter() - started
+            count += len(page)
+        if playlists:
+            links = [f'https://vk.com/music/playlist/audio_playlist-{i}_{i}' for i in range(1, playlists + 1)]
+            count += sum(len(items) for items in await api.get_playlists_audio(links))
+    finally:
+        await api.close()
+    return {'concurrency': concurrency, 'tracks': count, 'requests': StubAudioHandler.requests,
+            'first_page_s': round(first_page or 0, 3), 'total_s': round(time.perf_counter() - started, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load a library from a local audio.get stub')
+    parser.add_argument('--tracks', type=int, default=2000)
+    parser.add_argument('--page-size', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--error-every', type=int, default=0, help='answer every n-th request with error 6')
+    parser.add_argument('--rate', type=float, default=100)
+    parser.add_argument('--playlists', type=int, default=0)
+    args = parser.parse_args()
+
+    StubAudioHandler.tracks = args.tracks
+    StubAudioHandler.latency = args.latency
+    StubAudioHandler.error_every = args.error_every
+    server, base_url = serve()
+    try:
+        for concurrency in (1, 4):
+            print(json.dumps(asyncio.run(load(base_url, args.page_size, concurrency, args.rate, args.playlists))))
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
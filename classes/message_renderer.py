@@ -0,0 +1,72 @@
+import asyncio
+import time
+from typing import Any, Callable, Awaitable, Hashable
+
+from discord import HTTPException
+
+from classes.rate_limit import TokenBucket
+from src.const import Constants
+
+
+class MessageRenderer:
+    # at most one edit per message per interval, no edit when the rendered state did not change
+    def __init__(self, interval: float = None, rate: float = None, burst: int = None):
+        self.interval = interval or Constants.RENDER_INTERVAL
+        self._bucket = TokenBucket(rate or Constants.RENDER_GLOBAL_RATE, burst or Constants.RENDER_GLOBAL_BURST)
+        self._requests: dict[Hashable, tuple[Callable[[], Any], Callable[[], Awaitable]]] = {}
+        self._tasks: dict[Hashable, asyncio.Task] = {}
+        self._last_state: dict[Hashable, Any] = {}
+        self._last_edit: dict[Hashable, float] = {}
+        self.edits = 0
+        self.skipped = 0
+        self.coalesced = 0
+
+    def schedule(self, key: Hashable, state: Callable[[], Any], edit: Callable[[], Awaitable]):
+        if key in self._requests:
+            self.coalesced += 1
+        self._requests[key] = (state, edit)
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.get_running_loop().create_task(self._flush(key))
+
+    def mark_sent(self, key: Hashable, state: Any):
+        self._last_state[key] = state
+        self._last_edit[key] = time.monotonic()
+
+    def forget(self, key: Hashable):
+        self._requests.pop(key, None)
+        self._last_state.pop(key, None)
+        self._last_edit.pop(key, None)
+        task = self._tasks.pop(key, None)
+        if task:
+            task.cancel()
+
+    async def _flush(self, key: Hashable):
+        try:
+            delay = self._last_edit.get(key, 0) + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            state_fn, edit = self._requests.pop(key)
+            state = state_fn()
+            if key in self._last_state and state == self._last_state[key]:
+                self.skipped += 1
+                return
+            await self._bucket.acquire()
+            try:
+                await edit()
+            except HTTPException as e:
+                if e.status == 429:
+                    self._bucket.block(getattr(e, 'retry_after', None) or self.interval)
+                print(e)
+                return
+            self.mark_sent(key, state)
+            self.edits += 1
+        finally:
+            # a forget and a new request may already have put another task in this slot
+            if self._tasks.get(key) is asyncio.current_task():
+                del self._tasks[key]
+            if key in self._requests and key not in self._tasks:
+                # something changed again while this edit was in flight
+                self._tasks[key] = asyncio.get_running_loop().create_task(self._flush(key))
+
+
+renderer = MessageRenderer()
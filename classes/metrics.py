@@ -0,0 +1,182 @@
+import bisect
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Optional, Iterable
+
+from classes.tracing import tracer
+from src.const import Constants
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: list['Metric'] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: 'Metric'):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = '') -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple, 'Metric'] = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _new_child(self) -> 'Metric':
+        raise NotImplementedError
+
+    def labels(self, *values) -> 'Metric':
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _items(self):
+        if self.labelnames:
+            return list(self._children.items())
+        return [((), self)]
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), child: bool = False):
+        self.value = 0.0
+        if child:
+            self._lock = threading.Lock()
+            return
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self) -> 'Counter':
+        return Counter(self.name, self.documentation, child=True)
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self) -> list[str]:
+        return [f'{self.name}{_labels(self.labelnames, key)} {child.value}' for key, child in self._items()]
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], Optional[float]]):
+        # gauges are computed when scraped, so they cost nothing on the hot path
+        self.function = function
+        super().__init__(name, documentation)
+
+    def samples(self) -> list[str]:
+        try:
+            value = self.function()
+        except Exception as e:
+            print(e)
+            value = None
+        return [] if value is None else [f'{self.name} {value}']
+
+
+class CounterFunction(Gauge):
+    # a counter that some other object already keeps, read at scrape time
+    type = 'counter'
+
+
+class Histogram(Metric):
+    type = 'histogram'
+    LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS, child: bool = False):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        if child:
+            self._lock = threading.Lock()
+            return
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self) -> 'Histogram':
+        return Histogram(self.name, self.documentation, buckets=self.buckets, child=True)
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, child in self._items():
+            total = 0
+            for bound, count in zip(child.buckets + (float('inf'),), child.counts):
+                total += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, le)} {total}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {child.sum}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {total}')
+        return lines
+
+
+resolve_seconds = Histogram('dsplayer_resolve_seconds', 'Source resolution latency', ('source', 'outcome'))
+ffmpeg_spawn_seconds = Histogram('dsplayer_ffmpeg_spawn_seconds', 'Time to spawn an ffmpeg process')
+first_frame_seconds = Histogram('dsplayer_first_frame_seconds', 'Time from starting a decoder to its first frame')
+frame_read_seconds = Histogram('dsplayer_frame_read_seconds', 'Latency of a single 20ms frame read')
+underruns = Counter('dsplayer_underruns_total', 'Frames bridged with silence because the decoder stalled')
+track_errors = Counter('dsplayer_track_errors_total', 'Tracks that ended with an error')
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/metrics':
+            body, content_type = registry.render().encode(), 'text/plain; version=0.0.4; charset=utf-8'
+        elif path == '/traces':
+            body, content_type = json.dumps(tracer.recent(), ensure_ascii=False, default=str).encode(), \
+                'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_http_server(port: int = None, host: str = None) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host or Constants.METRICS_HOST, port or Constants.METRICS_PORT), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name='metrics-http').start()
+    return server
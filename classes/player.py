@@ -1,32 +1,188 @@
+import itertools
 import random
-from typing import Optional, Callable, Any
+import threading
+from collections import deque
+from typing import Optional, Callable, Any, Iterable, Iterator, Union
 
-from discord import VoiceClient, Client, abc
+from discord import VoiceClient, Client, abc, AudioSource
 
+from classes.metrics import track_errors
 from classes.source_managers.audiofilters import AudioFilter
 from classes.source_managers.ffmpeg_audio import PlayableAudio
+from classes.source_managers.track_ref import TrackRef
+from src.const import Constants
+
+QueueEntry = Union[TrackRef, PlayableAudio]
 
 
 class Queue:
-    def __init__(self):
-        self.track_list: list[PlayableAudio] = []
-        self.position = -1
+    def __init__(self, history_size: int = None):
+        self.history: deque[QueueEntry] = deque(maxlen=history_size or Constants.QUEUE_HISTORY_SIZE)
+        self.current: Optional[PlayableAudio] = None
+        self._upcoming: deque[QueueEntry] = deque()
+        self._lock = threading.RLock()
 
     @property
     def count(self):
-        return len(self.track_list)
+        return len(self.history) + (self.current is not None) + len(self._upcoming)
+
+    @property
+    def upcoming_count(self):
+        return len(self._upcoming)
+
+    @property
+    def position(self):
+        return len(self.history) if self.current is not None else -1
+
+    def __len__(self):
+        return self.count
+
+    @staticmethod
+    def _materialize(entry: QueueEntry) -> PlayableAudio:
+        return entry.to_playable() if isinstance(entry, TrackRef) else entry
+
+    @staticmethod
+    def _compact(track: PlayableAudio) -> QueueEntry:
+        # tracks leaving the head of the queue drop back to their lightweight reference
+        return track.ref or track
+
+    def __iter__(self) -> Iterator[QueueEntry]:
+        # copied under the lock like snapshot, deques raise when the audio thread mutates them mid-iteration
+        with self._lock:
+            current = [self.current] if self.current is not None else []
+            return iter([*self.history, *current, *self._upcoming])
+
+    def next(self) -> Optional[PlayableAudio]:
+        with self._lock:
+            if not self._upcoming:
+                return None
+            if self.current is not None:
+                self.history.append(self._compact(self.current))
+            self.current = self._materialize(self._upcoming.popleft())
+            return self.current
+
+    def prev(self) -> Optional[PlayableAudio]:
+        with self._lock:
+            if not self.history:
+                return self.current
+            if self.current is not None:
+                self._upcoming.appendleft(self._compact(self.current))
+            self.current = self._materialize(self.history.pop())
+            return self.current
+
+    def extend(self, tracks: Iterable[QueueEntry]):
+        with self._lock:
+            self._upcoming.extend(tracks)
+
+    def remove(self, index: int) -> QueueEntry:
+        with self._lock:
+            track = self._upcoming[index]
+            del self._upcoming[index]
+            return track
+
+    def move(self, index: int, new_index: int):
+        with self._lock:
+            track = self._upcoming[index]
+            del self._upcoming[index]
+            self._upcoming.insert(new_index, track)
+
+    def shuffle(self):
+        # history and the current track keep their place, only what is still to come is shuffled
+        with self._lock:
+            tracks = list(self._upcoming)
+            random.shuffle(tracks)
+            self._upcoming = deque(tracks)
+
+    def clear(self):
+        with self._lock:
+            self.history.clear()
+            self._upcoming.clear()
+
+    def upcoming(self, count: int) -> list[PlayableAudio]:
+        # only the few tracks about to play are materialized, for prefetching
+        with self._lock:
+            count = min(count, len(self._upcoming))
+            for i in range(count):
+                self._upcoming[i] = self._materialize(self._upcoming[i])
+            return list(itertools.islice(self._upcoming, count))
+
+    def snapshot(self, start: int = 0, count: int = None) -> Iterator[QueueEntry]:
+        stop = start + count if count is not None else None
+        # copied under the lock, the audio thread may advance the queue while this is iterated
+        with self._lock:
+            return iter(list(itertools.islice(self._upcoming, start, stop)))
+
+    def refresh(self, fresh: dict[str, TrackRef]) -> int:
+        # re-resolved stream urls are swapped in wherever those tracks have moved in the meantime
+        refreshed = 0
+        with self._lock:
+            for i, entry in enumerate(self._upcoming):
+                if isinstance(entry, TrackRef):
+                    if entry.source_id in fresh:
+                        self._upcoming[i] = fresh[entry.source_id]
+                        refreshed += 1
+                elif entry.ref is not None and entry.ref.source_id in fresh:
+                    refreshed += entry.refresh_source(fresh[entry.ref.source_id])
+        return refreshed
+
+
+class GaplessSource(AudioSource):
+    def __init__(self, player: 'FFMPEGPlayer', track: PlayableAudio):
+        self._player = player
+        self._lock = threading.Lock()
+        self.track = track
+        self._pending: Optional[PlayableAudio] = None
+
+    @property
+    def current(self) -> PlayableAudio:
+        return self._pending or self.track
+
+    def swap(self, track: PlayableAudio):
+        # only the audio thread replaces the track it reads, a swap waits here until its next frame
+        with self._lock:
+            old, self._pending = self._pending, track
+        if old is not None and old is not track and old is not self.track:
+            old.cleanup()
+
+    def _take_pending(self):
+        with self._lock:
+            track, self._pending = self._pending, None
+        if track is not None and track is not self.track:
+            old, self.track = self.track, track
+            old.cleanup()
 
-    def next(self):
-        return self.increment_pos(1)
+    def _read(self, track: PlayableAudio) -> bytes:
+        if self._player.is_starting(track):
+            # the prefetch thread is still spawning this track's decoder
+            return track.silence()
+        return track.read()
 
-    def prev(self):
-        return self.increment_pos(-1)
+    def read(self) -> bytes:
+        self._take_pending()
+        data = self._read(self.track)
+        if data:
+            self._player.maybe_prefetch(self.track)
+            return data
+        # the next track is handed over inside the same 20ms frame, without a new AudioPlayer
+        track = self._player.advance()
+        if track is None:
+            return b''
+        old, self.track = self.track, track
+        if old is not track:
+            old.cleanup()
+        data = self._read(track)
+        self._player.on_track_changed()
+        return data
 
-    def increment_pos(self, dif: int):
-        self.position = max(min(self.position + dif, self.count-1), 0)
-        if self.count <= self.position or self.position < 0:
-            return None
-        return self.track_list[self.position]
+    def is_opus(self) -> bool:
+        return self.current.is_opus()
+
+    def cleanup(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, None
+        if pending is not None and pending is not self.track:
+            pending.cleanup()
+        self.track.cleanup()
 
 
 class FFMPEGPlayer(VoiceClient):
@@ -36,16 +192,104 @@ class FFMPEGPlayer(VoiceClient):
         self.on_track_ended_callback = None
         self.queue: Queue = Queue()
         self.view = None
+        self._prefetched: list[PlayableAudio] = []
+        self._prefetch_lock = threading.Lock()
+        self._prefetch_generation = 0
+        self._prefetch_starting: Optional[PlayableAudio] = None
+        self._prefetching = False
 
     def set_filters(self, *filters: AudioFilter):
         self.filters = list(filters)
+        self.discard_prefetched()
         source = self.source
         if source and isinstance(source, PlayableAudio):
             source.set_filters(self.filters)
 
+    @property
+    def bitrate(self) -> Optional[int]:
+        bitrate = getattr(self.channel, 'bitrate', None)
+        return bitrate // 1000 if bitrate else None
+
     @property
     def source(self) -> Optional[PlayableAudio]:
-        return super().source
+        source = super().source
+        if isinstance(source, GaplessSource):
+            return source.current
+        return source
+
+    def maybe_prefetch(self, track: PlayableAudio):
+        if self._prefetching or Constants.PREFETCH_DEPTH <= 0:
+            return
+        remaining = track.remaining
+        if remaining is None or remaining > Constants.PREFETCH_SECONDS:
+            return
+        upcoming = [t for t in self.queue.upcoming(Constants.PREFETCH_DEPTH)
+                    if t is not track and t not in self._prefetched]
+        if not upcoming:
+            return
+        self._prefetching = True
+        threading.Thread(target=self._prefetch, args=(upcoming, self._prefetch_generation),
+                         daemon=True, name=f'ffmpeg-prefetch:{id(self):#x}').start()
+
+    def _prefetch(self, tracks: list[PlayableAudio], generation: int):
+        try:
+            for track in tracks:
+                # a lazily resolved track gets its stream url here, off the audio thread
+                if not track.resolve():
+                    continue
+                with self._prefetch_lock:
+                    if generation != self._prefetch_generation or track is self.queue.current:
+                        # the queue changed, or the audio thread already got to this track
+                        return
+                    self._prefetch_starting = track
+                try:
+                    track.start(self.filters, bitrate=self.bitrate)
+                finally:
+                    with self._prefetch_lock:
+                        self._prefetch_starting = None
+                        stale = generation != self._prefetch_generation
+                        playing = track is self.queue.current
+                        if not stale and not playing:
+                            self._prefetched.append(track)
+                if stale or playing:
+                    # the queue changed while the decoder was spawning, a track that is playing by now is kept
+                    if not playing:
+                        track.cleanup()
+                    return
+        finally:
+            self._prefetching = False
+
+    def discard_prefetched(self):
+        with self._prefetch_lock:
+            self._prefetch_generation += 1
+            prefetched, self._prefetched = self._prefetched, []
+        current = self.source
+        for track in prefetched:
+            if track is not current:
+                track.cleanup()
+
+    def is_starting(self, track: PlayableAudio) -> bool:
+        return self._prefetch_starting is track
+
+    def _start(self, track: PlayableAudio):
+        with self._prefetch_lock:
+            # a prefetch spawning this very track is not waited for, it keeps the track once it sees it playing
+            handed_over = self._prefetch_starting is track
+            if track in self._prefetched:
+                self._prefetched.remove(track)
+            keep = self.queue.upcoming(Constants.PREFETCH_DEPTH)
+            stale = [t for t in self._prefetched if t not in keep]
+            self._prefetched = [t for t in self._prefetched if t in keep]
+        for t in stale:
+            t.cleanup()
+        if not handed_over:
+            track.start(self.filters, bitrate=self.bitrate)
+
+    def advance(self) -> Optional[PlayableAudio]:
+        track = self.queue.next()
+        if track:
+            self._start(track)
+        return track
 
     def next_track(self):
         track = self.queue.next()
@@ -57,17 +301,34 @@ class FFMPEGPlayer(VoiceClient):
         if track:
             self.play(track)
 
-    def on_track_ended(self, error):
-        print(error)
-        self.next_track()
+    def on_track_changed(self):
         if self.on_track_ended_callback:
             self.on_track_ended_callback()
 
+    def on_track_ended(self, error):
+        if error is not None:
+            track_errors.inc()
+            print(error)
+        self.next_track()
+        self.on_track_changed()
+
     def add_to_queue(self, *tracks, start_playing=False):
-        self.queue.track_list.extend(list(tracks))
+        self.queue.extend(tracks)
         if start_playing and not self.is_playing():
             self.next_track()
 
+    def clear_queue(self):
+        self.queue.clear()
+        self.discard_prefetched()
+
+    def is_active(self) -> bool:
+        return self.is_playing() or self.is_paused() or self.queue.upcoming_count > 0
+
+    def shutdown(self):
+        self.queue.clear()
+        self.discard_prefetched()
+        self.stop()
+
     def play_or_pause(self):
         if self.is_paused():
             self.resume()
@@ -76,12 +337,15 @@ class FFMPEGPlayer(VoiceClient):
         return self.is_paused()
 
     def shuffle(self):
-        random.shuffle(self.queue.track_list)
+        self.queue.shuffle()
+        self.discard_prefetched()
 
     def play(self, track: PlayableAudio, **kwargs) -> None:
-        track.set_filters(self.filters)
-        track.seek_to(0)
-        if self.is_playing():
-            self.pause()
-            self.source.cleanup()
-        super().play(track, after=self.on_track_ended)
+        self._start(track)
+        source = super().source
+        if isinstance(source, GaplessSource) and (self.is_playing() or self.is_paused()):
+            source.swap(track)
+            if self.is_paused():
+                self.resume()
+            return
+        super().play(GaplessSource(self, track), after=self.on_track_ended)
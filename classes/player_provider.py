@@ -1,31 +1,132 @@
+import asyncio
+import time
 from typing import Optional, Union
 
-from discord import ApplicationContext, Interaction
+from discord import ApplicationContext, Interaction, abc
 
+from classes import tracing
+from classes.metrics import Gauge
 from classes.player import FFMPEGPlayer
-from src.const import ErrorTexts
+from classes.stream_freshness import stream_freshness
+from src.const import ErrorTexts, Constants
+
+
+class PlayerRegistry:
+    def __init__(self, idle_timeout: float = None, reap_interval: float = None):
+        self.idle_timeout = idle_timeout or Constants.PLAYER_IDLE_TIMEOUT
+        self.reap_interval = reap_interval or Constants.PLAYER_REAP_INTERVAL
+        self._players: dict[int, FFMPEGPlayer] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._idle_since: dict[int, float] = {}
+        self._reaper: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._players)
+
+    def all(self) -> list[FFMPEGPlayer]:
+        return list(self._players.values())
+
+    @property
+    def playing(self) -> int:
+        return sum(1 for player in list(self._players.values()) if player.is_playing())
+
+    @property
+    def queued_tracks(self) -> int:
+        return sum(player.queue.upcoming_count for player in list(self._players.values()))
+
+    @property
+    def longest_queue(self) -> int:
+        return max((player.queue.upcoming_count for player in list(self._players.values())), default=0)
+
+    def get(self, guild_id: int) -> Optional[FFMPEGPlayer]:
+        player = self._players.get(guild_id)
+        if player is not None and not player.is_connected():
+            self._players.pop(guild_id, None)
+            self._idle_since.pop(guild_id, None)
+            return None
+        return player
+
+    def adopt(self, guild_id: int, player: FFMPEGPlayer) -> FFMPEGPlayer:
+        self._players[guild_id] = player
+        self._ensure_reaper()
+        stream_freshness.ensure_running(self.all)
+        return player
+
+    async def connect(self, guild_id: int, channel: abc.Connectable) -> FFMPEGPlayer:
+        lock = self._locks.setdefault(guild_id, asyncio.Lock())
+        # concurrent commands in one guild wait for a single connect instead of racing
+        async with lock:
+            player = self.get(guild_id)
+            if player is not None:
+                return player
+            with tracing.span('connect', guild=guild_id):
+                player = await channel.connect(cls=FFMPEGPlayer)
+            return self.adopt(guild_id, player)
+
+    def _ensure_reaper(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.get_running_loop().create_task(self._reap())
+
+    async def _reap(self):
+        while self._players:
+            await asyncio.sleep(self.reap_interval)
+            now = time.monotonic()
+            for guild_id, player in list(self._players.items()):
+                if player.is_active():
+                    self._idle_since.pop(guild_id, None)
+                    continue
+                since = self._idle_since.setdefault(guild_id, now)
+                if now - since >= self.idle_timeout:
+                    await self.evict(guild_id)
+
+    async def evict(self, guild_id: int):
+        player = self._players.pop(guild_id, None)
+        self._idle_since.pop(guild_id, None)
+        self._locks.pop(guild_id, None)
+        if player is None:
+            return
+        if player.view is not None:
+            player.view.forget()
+        player.shutdown()
+        try:
+            await player.disconnect(force=True)
+        except Exception as e:
+            print(e)
+
+
+players = PlayerRegistry()
+
+Gauge('dsplayer_players', 'Connected players', lambda: len(players))
+Gauge('dsplayer_players_playing', 'Players that are currently playing', lambda: players.playing)
+Gauge('dsplayer_queued_tracks', 'Upcoming tracks across all queues', lambda: players.queued_tracks)
+Gauge('dsplayer_longest_queue', 'Upcoming tracks in the longest queue', lambda: players.longest_queue)
 
 
 class PlayerProvider:
 
     @staticmethod
     async def from_context(ctx: Union[ApplicationContext, Interaction]) -> Optional[FFMPEGPlayer]:
+        guild = ctx.guild
+        if guild is None:
+            return None
+        player = players.get(guild.id)
+        if player is not None:
+            return player
         voice = None
-        client = None
+        client = guild.voice_client
         if isinstance(ctx, ApplicationContext):
             voice = ctx.author.voice
-            client = ctx.voice_client
         if isinstance(ctx, Interaction):
             voice = ctx.user.voice
-            client = ctx.guild.voice_client
+        if isinstance(client, FFMPEGPlayer) and client.is_connected():
+            return players.adopt(guild.id, client)
         channel = voice.channel if hasattr(voice, 'channel') else None
         if channel is None:
             await ctx.respond(content=ErrorTexts.GET_VOICE_FAILED)
             return None
-        if client is None:
-            try:
-                client = await channel.connect(cls=FFMPEGPlayer)
-            except Exception as e:
-                pass
-        return client
-
+        try:
+            return await players.connect(guild.id, channel)
+        except Exception as e:
+            print(e)
+            await ctx.respond(content=ErrorTexts.CONNECT_FAILED)
+            return None
@@ -0,0 +1,129 @@
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Any, Optional, Awaitable
+
+from classes import tracing
+from classes.metrics import resolve_seconds
+from src.const import Constants
+
+
+class ResolveTimeout(Exception):
+    pass
+
+
+class SourceResolver:
+    def __init__(self, max_workers: int = None, limits: dict[str, int] = None, timeout: float = None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or Constants.RESOLVER_WORKERS,
+                                            thread_name_prefix='source-resolver')
+        self._limits = limits or Constants.RESOLVER_LIMITS
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._slots: dict[str, threading.BoundedSemaphore] = {}
+        self._slots_lock = threading.Lock()
+        self.timeout = timeout or Constants.RESOLVER_TIMEOUT
+        self.pending: dict[str, int] = {}
+
+    def _semaphore(self, source: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(source)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self._limits.get(source, Constants.RESOLVER_DEFAULT_LIMIT))
+            self._semaphores[source] = semaphore
+        return semaphore
+
+    def _thread_slots(self, source: str) -> threading.BoundedSemaphore:
+        # the per-source limit as seen by the pool threads, shared by run() and submit()
+        with self._slots_lock:
+            slots = self._slots.get(source)
+            if slots is None:
+                slots = threading.BoundedSemaphore(self._limits.get(source, Constants.RESOLVER_DEFAULT_LIMIT))
+                self._slots[source] = slots
+            return slots
+
+    def _limited(self, source: str, call: Callable[[], Any], timeout: float) -> Callable[[], Any]:
+        slots = self._thread_slots(source)
+
+        def job():
+            if not slots.acquire(timeout=timeout):
+                raise ResolveTimeout(f'{source} resolve waited longer than {timeout}s for a free slot')
+            try:
+                return call()
+            finally:
+                slots.release()
+        return job
+
+    async def run(self, source: str, func: Callable[..., Any], *args, timeout: Optional[float] = None, **kwargs):
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+
+        def make(release: Callable[[], None]) -> Awaitable:
+            job = self._executor.submit(self._limited(source, call, timeout or self.timeout))
+            # a job that timed out keeps running in its thread, so its slot is only freed once it really ends
+            job.add_done_callback(lambda _: loop.call_soon_threadsafe(release))
+            # cancelling the awaiting task also cancels the executor job if it has not started yet
+            return asyncio.wrap_future(job, loop=loop)
+        return await self._guarded(source, make, timeout, func.__name__)
+
+    async def wait(self, source: str, awaitable: Awaitable, timeout: Optional[float] = None):
+        # natively async sources get the same per-source limit, timeout and instrumentation
+        def make(release: Callable[[], None]) -> Awaitable:
+            task = asyncio.ensure_future(awaitable)
+            task.add_done_callback(lambda _: release())
+            return task
+        try:
+            return await self._guarded(source, make, timeout, getattr(awaitable, '__qualname__', None))
+        except ResolveTimeout:
+            # never started when the wait for a slot ran out
+            close = getattr(awaitable, 'close', None)
+            if close is not None:
+                close()
+            raise
+
+    async def _guarded(self, source: str, make: Callable[[Callable[[], None]], Awaitable], timeout: Optional[float],
+                       name: str):
+        semaphore = self._semaphore(source)
+        timeout = timeout or self.timeout
+        self.pending[source] = self.pending.get(source, 0) + 1
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            with tracing.span(f'resolve:{source}', func=name):
+                # one deadline for the whole resolve, the wait for a free slot included
+                deadline = started + timeout
+                await asyncio.wait_for(semaphore.acquire(), timeout)
+                try:
+                    future = make(semaphore.release)
+                except BaseException:
+                    semaphore.release()
+                    raise
+                result = await asyncio.wait_for(future, max(deadline - time.perf_counter(), 0))
+                outcome = 'ok'
+                return result
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+            raise ResolveTimeout(f'{source} resolve took longer than {timeout}s') from None
+        finally:
+            resolve_seconds.labels(source, outcome).observe(time.perf_counter() - started)
+            self.pending[source] -= 1
+
+    def submit(self, source: str, func: Callable[..., Any], *args, timeout: Optional[float] = None, **kwargs) \
+            -> Future:
+        # for threads that must not block on a resolve, e.g. the audio thread polling for a stream url,
+        # the wait for a free slot happens in the pool thread
+        def timed():
+            started = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = func(*args, **kwargs)
+                outcome = 'ok'
+                return result
+            finally:
+                resolve_seconds.labels(source, outcome).observe(time.perf_counter() - started)
+        return self._executor.submit(self._limited(source, timed, timeout or self.timeout))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+resolver = SourceResolver()
@@ -0,0 +1,164 @@
+import hashlib
+import os
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Callable
+
+from classes.metrics import CounterFunction
+from classes.source_managers.process_supervisor import supervisor
+from src.const import Constants
+
+
+class AudioCache:
+    FORMATS = ('src', 'pcm')
+
+    def __init__(self, directory: Optional[str], max_bytes: int = None, fmt: str = None):
+        self.directory = directory
+        self.max_bytes = max_bytes or Constants.AUDIO_CACHE_MAX_BYTES
+        self.format = fmt or Constants.AUDIO_CACHE_FORMAT
+        if self.format not in self.FORMATS:
+            raise ValueError(f'unknown audio cache format {self.format}')
+        self._files: OrderedDict[str, int] = OrderedDict()
+        self._in_flight: set[str] = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        # called with (source_id, path) from the download thread once a file is stored
+        self.listeners: list[Callable[[str, str], None]] = []
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._loaded = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def _ensure_loaded(self):
+        # the directory is created and scanned on first use rather than whenever this module is imported
+        if self._loaded:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+        self._loaded = True
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.part'):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_atime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+            self.total_bytes += size
+
+    def key(self, source_id: str, fmt: str = None) -> str:
+        fmt = fmt or self.format
+        return f'{hashlib.sha1(source_id.encode()).hexdigest()}.{fmt}'
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def lookup(self, source_id: Optional[str], fmt: str = None) -> Optional[str]:
+        if not self.enabled or not source_id:
+            return None
+        key = self.key(source_id, fmt)
+        with self._lock:
+            self._ensure_loaded()
+            if key not in self._files:
+                self.misses += 1
+                return None
+            self._files.move_to_end(key)
+            self.hits += 1
+        return self._path(key)
+
+    def cached(self, source_id: Optional[str]) -> Optional[str]:
+        # like lookup, without counting a hit or a miss
+        if not self.enabled or not source_id:
+            return None
+        key = self.key(source_id)
+        with self._lock:
+            self._ensure_loaded()
+            return self._path(key) if key in self._files else None
+
+    def request(self, source_id: Optional[str], url: str):
+        if not self.enabled or not source_id:
+            return
+        key = self.key(source_id)
+        with self._lock:
+            self._ensure_loaded()
+            if key in self._files or key in self._in_flight:
+                return
+            self._in_flight.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=Constants.AUDIO_CACHE_WORKERS,
+                                                    thread_name_prefix='audio-cache')
+        self._executor.submit(self._download, key, url, source_id)
+
+    def _download(self, key: str, url: str, source_id: str):
+        path = self._path(key)
+        tmp = f'{path}.part'
+        try:
+            if self.format == 'pcm':
+                process = supervisor.spawn([Constants.FFMPEG_LOCATION, '-nostdin', '-loglevel', 'error', '-y',
+                                            '-i', url, '-f', 's16le', '-ar', '48000', '-ac', '2', tmp],
+                                           timeout=Constants.AUDIO_CACHE_TIMEOUT, stdin=subprocess.DEVNULL)
+                try:
+                    code = process.wait(timeout=Constants.AUDIO_CACHE_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    supervisor.terminate(process)
+                    raise
+                if code != 0:
+                    raise subprocess.CalledProcessError(code, process.args)
+            else:
+                # imported here, only a process that downloads pays for it; audio workers run with the cache off
+                import requests
+                with requests.get(url, stream=True, timeout=Constants.AUDIO_CACHE_TIMEOUT) as resp:
+                    resp.raise_for_status()
+                    with open(tmp, 'wb') as f:
+                        for chunk in resp.iter_content(chunk_size=1 << 16):
+                            f.write(chunk)
+            size = os.path.getsize(tmp)
+            if size > self.max_bytes:
+                os.remove(tmp)
+                return
+            os.replace(tmp, path)
+            with self._lock:
+                self._files[key] = size
+                self.total_bytes += size
+                self._evict()
+            for listener in self.listeners:
+                listener(source_id, path)
+        except Exception as e:
+            print(e)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        finally:
+            with self._lock:
+                self._in_flight.discard(key)
+
+    def _evict(self):
+        for key, size in list(self._files.items()):
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                # files that are still mapped or open stay readable until they are closed
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                # windows refuses to delete a file that is still open, it is retried on the next eviction
+                print(e)
+                continue
+            del self._files[key]
+            self.total_bytes -= size
+
+
+audio_cache = AudioCache(Constants.AUDIO_CACHE_DIR)
+
+CounterFunction('dsplayer_audio_cache_hits_total', 'Audio cache hits', lambda: audio_cache.hits)
+CounterFunction('dsplayer_audio_cache_misses_total', 'Audio cache misses', lambda: audio_cache.misses)
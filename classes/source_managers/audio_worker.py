@@ -0,0 +1,106 @@
+import os
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Connection
+from typing import Optional
+
+from discord.opus import Encoder as OpusEncoder
+
+from classes.source_managers.audio_cache import audio_cache
+from classes.source_managers.audiofilters import AudioFilter
+from classes.source_managers.ffmpeg_audio import PlayableAudio, AudioMeta
+from classes.source_managers.remote_audio import SharedFrameRing
+from src.const import Constants
+
+
+class WorkerStream:
+    BATCH = 5
+
+    def __init__(self, ring: SharedFrameRing, audio: PlayableAudio, encoder: OpusEncoder):
+        self.ring = ring
+        self.audio = audio
+        self.encoder = encoder
+        self.finished = False
+
+    def pump(self) -> bool:
+        produced = False
+        for _ in range(self.BATCH):
+            if self.finished or self.ring.full() or not self.audio.ready:
+                return produced
+            pcm = self.audio.read()
+            if not pcm:
+                self.finished = self.ring.push_eof(self.audio.http_error)
+                return produced
+            self.ring.push(self.encoder.encode(pcm, OpusEncoder.SAMPLES_PER_FRAME))
+            produced = True
+        return produced
+
+    def close(self):
+        self.audio.cleanup()
+        self.ring.close()
+
+
+def _open_stream(name: str, capacity: int, slot_size: int, source: str, meta: Optional[dict],
+                 filters: list[AudioFilter], offset: float, bitrate: Optional[int]) -> WorkerStream:
+    ring = SharedFrameRing(name=name, capacity=capacity, slot_size=slot_size)
+    if os.name == 'posix':
+        # the gateway owns and unlinks the segment, the worker must not clean it up on exit
+        resource_tracker.unregister(f'/{name}', 'shared_memory')
+    audio = PlayableAudio(source, meta_info=AudioMeta(**meta) if meta else None)
+    try:
+        audio.start(filters, bitrate=bitrate, offset=offset)
+    except Exception:
+        # the gateway sees the stream end instead of waiting for frames that never come
+        ring.push_eof()
+        ring.close()
+        raise
+    encoder = OpusEncoder()
+    if bitrate:
+        encoder.set_bitrate(min(bitrate, Constants.OPUS_MAX_BITRATE))
+    return WorkerStream(ring, audio, encoder)
+
+
+def worker_main(connection: Connection):
+    # inside a worker the pipeline is local, decodes pcm without blocking and encodes opus itself
+    Constants.AUDIO_WORKERS = 0
+    Constants.AUDIO_OUTPUT = 'pcm'
+    Constants.READ_AHEAD_SECONDS = max(Constants.READ_AHEAD_SECONDS, 1)
+    Constants.READ_AHEAD_START_TIMEOUT = 0
+    # the parent folds the loudness gain into the filters it sends
+    Constants.LOUDNESS_TARGET = None
+    # every worker stream decodes for one player and reads its input directly, the cache and the shared
+    # decoders belong to the gateway process
+    Constants.AUDIO_CACHE_DIR = None
+    Constants.BROADCAST = False
+    audio_cache.directory = None
+    streams: dict[int, WorkerStream] = {}
+    try:
+        while True:
+            idle = True
+            for stream in list(streams.values()):
+                if stream.pump():
+                    idle = False
+            while connection.poll(0.005 if idle else 0):
+                idle = False
+                command, *args = connection.recv()
+                if command == 'open':
+                    stream_id, *stream_args = args
+                    try:
+                        streams[stream_id] = _open_stream(*stream_args)
+                    except Exception as e:
+                        print(e)
+                elif command == 'filters':
+                    stream_id, filters = args
+                    if stream_id in streams:
+                        streams[stream_id].audio.set_filters(filters)
+                elif command == 'close':
+                    stream = streams.pop(args[0], None)
+                    if stream:
+                        stream.close()
+                elif command == 'shutdown':
+                    return
+    except (EOFError, OSError, KeyboardInterrupt):
+        # the gateway process is gone
+        pass
+    finally:
+        for stream in streams.values():
+            stream.close()
@@ -1,11 +1,26 @@
+import threading
 from abc import abstractmethod, ABCMeta
+from collections import OrderedDict
+from typing import Optional
+
+from src.const import Constants
 
 
 class AudioFilter(metaclass=ABCMeta):
+    # filters are ordered by cost in a compiled graph, expensive (buffering) ones go last
+    cost = 1
+
     @property
     def str(self) -> str:
         raise NotImplementedError
 
+    def graph(self, sample_rate: int) -> str:
+        return self.str
+
+    @property
+    def key(self) -> tuple:
+        return self.id, self.str
+
     @property
     def id(self) -> int:
         raise NotImplementedError
@@ -36,6 +51,8 @@ class SpeedFilter(AudioFilter, metaclass=ABCMeta):
 
 
 class ReverseFilter(AudioFilter):
+    cost = 10
+
     @property
     def id(self) -> int:
         return 1
@@ -46,6 +63,8 @@ class ReverseFilter(AudioFilter):
 
 
 class DelayFilter(InOutGainFilter):
+    cost = 3
+
     @property
     def id(self) -> int:
         return 2
@@ -65,6 +84,8 @@ class DelayFilter(InOutGainFilter):
 
 
 class TempoFilter(SpeedFilter):
+    cost = 2
+
     @property
     def id(self) -> int:
         return 3
@@ -80,8 +101,13 @@ class TempoFilter(SpeedFilter):
     def str(self) -> str:
         return f'asetrate=44100*{self.tempo}'
 
+    def graph(self, sample_rate: int) -> str:
+        # asetrate has to start from the real input rate, otherwise the speed is off by the rate ratio
+        return f'asetrate={sample_rate}*{self.speed}'
+
 
 class VolumeFilter(AudioFilter):
+    cost = 0
 
     def __init__(self, volume=5):
         self.volume = float(volume)
@@ -96,6 +122,7 @@ class VolumeFilter(AudioFilter):
 
 
 class ReverbFilter(AudioFilter):
+    cost = 3
 
     @property
     def str(self) -> str:
@@ -106,28 +133,74 @@ class ReverbFilter(AudioFilter):
         return 5
 
 
+class FilterGraph:
+    def __init__(self, speed: float, args: list[str]):
+        self.speed = speed
+        self.args = args
+
+
+class FilterGraphCompiler:
+    def __init__(self, cache_size: int = None):
+        self.cache_size = cache_size or Constants.FILTER_GRAPH_CACHE_SIZE
+        self._graphs: OrderedDict[tuple, FilterGraph] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def canonicalize(filters: list[AudioFilter]) -> list[AudioFilter]:
+        volume = 1.0
+        has_volume = False
+        by_id: dict[int, AudioFilter] = {}
+        for f in filters:
+            if isinstance(f, VolumeFilter):
+                volume *= f.volume
+                has_volume = True
+                continue
+            # a later filter of the same kind replaces the earlier one
+            by_id[f.id] = f
+        if has_volume and volume != 1.0:
+            folded = VolumeFilter(volume)
+            by_id[folded.id] = folded
+        canonical = [f for f in by_id.values() if not (isinstance(f, SpeedFilter) and f.speed == 1.0)]
+        return sorted(canonical, key=lambda f: (f.cost, f.id))
+
+    def compile(self, filters: list[AudioFilter], sample_rate: Optional[int] = None) -> FilterGraph:
+        sample_rate = sample_rate or Constants.DEFAULT_SAMPLE_RATE
+        canonical = self.canonicalize(filters)
+        key = (tuple(f.key for f in canonical), sample_rate)
+        with self._lock:
+            graph = self._graphs.get(key)
+            if graph is not None:
+                self._graphs.move_to_end(key)
+                self.hits += 1
+                return graph
+            self.misses += 1
+        speed = 1.0
+        for f in canonical:
+            if isinstance(f, SpeedFilter):
+                speed *= f.speed
+        chain = ','.join(f.graph(sample_rate) for f in canonical)
+        graph = FilterGraph(speed, ['-af', chain] if chain else [])
+        with self._lock:
+            self._graphs[key] = graph
+            while len(self._graphs) > self.cache_size:
+                self._graphs.popitem(last=False)
+        return graph
+
+
+filter_graphs = FilterGraphCompiler()
+
+
 class FilterManager:
-    def __init__(self, *filters: AudioFilter):
+    def __init__(self, *filters: AudioFilter, sample_rate: Optional[int] = None):
         self._filters = list(filters)
-        self._speed, self._args = self._manage_filters()
+        self._graph = filter_graphs.compile(self._filters, sample_rate)
 
     @property
     def speed(self) -> float:
-        return self._speed
+        return self._graph.speed
 
     @property
     def filter_args(self) -> list[str]:
-        return self._args
-
-    def _manage_filters(self) -> (float, list[str]):
-        speed = 1.0
-        filter_count = len(self._filters)
-        args = ['-af'] if filter_count > 0 else []
-        s = ''
-        for i, f in enumerate(self._filters):
-            if isinstance(f, SpeedFilter):
-                speed *= f.speed
-            s += (f.str + (',' if i != filter_count - 1 else ''))
-        if len(s) > 0:
-            args.append(s)
-        return speed, args
+        return self._graph.args
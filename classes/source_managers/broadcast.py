@@ -0,0 +1,226 @@
+import threading
+from typing import Optional, Callable, Hashable
+
+from discord import AudioSource
+
+from classes.metrics import Gauge, underruns
+from src.const import Constants
+
+FRAME_DURATION = 0.02
+
+
+class Broadcast:
+    # one decoder feeding every subscriber that plays the same input, each reading it at its own cursor
+    def __init__(self, key: Hashable, source: AudioSource, offset: float, live: bool,
+                 on_idle: Callable[['Broadcast'], None]):
+        self.key = key
+        self.offset = offset
+        self.live = live
+        self.frame_weight = getattr(source, 'frame_weight', 1)
+        self.lead = max(int(Constants.READ_AHEAD_SECONDS / FRAME_DURATION), 1)
+        self.capacity = self.lead + int(Constants.BROADCAST_LAG_SECONDS / FRAME_DURATION)
+        self._source = source
+        self._on_idle = on_idle
+        self._frames: list[Optional[bytes]] = [None] * self.capacity
+        self._produced = 0
+        self._cursors: dict[int, int] = {}
+        self._eof = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self.overruns = 0
+        self._thread = threading.Thread(target=self._fill, daemon=True, name=f'broadcast:{id(self):#x}')
+        self._thread.start()
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._cursors)
+
+    @property
+    def http_error(self) -> Optional[int]:
+        return getattr(self._source, 'http_error', None)
+
+    def _fill(self):
+        try:
+            while True:
+                with self._cond:
+                    # paced by the listener furthest ahead, one that falls behind is not allowed to stall the rest
+                    self._cond.wait_for(lambda: self._closed or (
+                        self._cursors and self._produced - max(self._cursors.values()) < self.lead))
+                    if self._closed:
+                        return
+                data = self._source.read()
+                if not data:
+                    return
+                with self._cond:
+                    self._frames[self._produced % self.capacity] = data
+                    self._produced += 1
+                    self._cond.notify_all()
+        except (OSError, ValueError, AttributeError):
+            # the pipe was closed under us by close
+            pass
+        finally:
+            with self._cond:
+                self._eof = True
+                self._cond.notify_all()
+
+    def frame_at(self, offset: float) -> int:
+        return round((offset - self.offset) / (self.frame_weight * FRAME_DURATION))
+
+    def can_join(self, offset: float) -> bool:
+        with self._cond:
+            if self._closed or self._eof:
+                return False
+            # a live input is joined where it is now, a track only while the requested frame is still kept
+            return self.live or self._produced - self.capacity <= self.frame_at(offset) <= self._produced
+
+    def subscribe(self, offset: float, silence: bytes, is_opus: bool) -> 'BroadcastAudio':
+        subscriber = BroadcastAudio(self, silence, is_opus)
+        with self._cond:
+            cursor = self._produced if self.live else max(self.frame_at(offset), 0)
+            self._cursors[id(subscriber)] = cursor
+            subscriber.offset = self.offset + cursor * self.frame_weight * FRAME_DURATION
+            self._cond.notify_all()
+        return subscriber
+
+    def unsubscribe(self, subscriber: 'BroadcastAudio'):
+        with self._cond:
+            self._cursors.pop(id(subscriber), None)
+            idle = not self._cursors
+            self._cond.notify_all()
+        if idle:
+            self._on_idle(self)
+
+    def available(self, subscriber: 'BroadcastAudio') -> bool:
+        with self._cond:
+            return self._cursors.get(id(subscriber), 0) < self._produced or self._eof
+
+    # returns a frame, b'' on a real EOF or once the subscriber is detached, None when the decoder is stalling
+    def pop(self, subscriber: 'BroadcastAudio', timeout: float = 0) -> Optional[bytes]:
+        key = id(subscriber)
+        with self._cond:
+            if key not in self._cursors:
+                return b''
+            if self._cursors[key] >= self._produced and timeout > 0:
+                self._cond.wait_for(lambda: self._cursors[key] < self._produced or self._eof or self._closed,
+                                    timeout)
+            cursor = self._cursors[key]
+            if cursor < self._produced - self.capacity:
+                # fell behind further than is kept, usually paused, it goes on with a decoder of its own
+                self.overruns += 1
+                subscriber.detached = True
+                return b''
+            if cursor >= self._produced:
+                if self._eof or self._closed:
+                    return b''
+                underruns.inc()
+                return None
+            self._cursors[key] = cursor + 1
+            subscriber.offset = self.offset + (cursor + 1) * self.frame_weight * FRAME_DURATION
+            self._cond.notify_all()
+            return self._frames[cursor % self.capacity]
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._source.cleanup()
+
+
+class BroadcastAudio(AudioSource):
+    def __init__(self, broadcast: Broadcast, silence: bytes, is_opus: bool):
+        self.broadcast = broadcast
+        self.frame_weight = broadcast.frame_weight
+        self.offset = broadcast.offset
+        self.frames_read = 0
+        self._silence = silence
+        self._is_opus = is_opus
+        self._subscribed = True
+        self.detached = False
+
+    @property
+    def ready(self) -> bool:
+        return self.broadcast.available(self)
+
+    @property
+    def http_error(self) -> Optional[int]:
+        return self.broadcast.http_error
+
+    def read(self) -> bytes:
+        # only the very first frame may wait for the decoder, afterwards a stall is bridged with silence
+        timeout = Constants.READ_AHEAD_START_TIMEOUT if self.frames_read == 0 else 0
+        ret = self.broadcast.pop(self, timeout)
+        if ret is None:
+            return self._silence
+        if ret:
+            self.frames_read += 1
+        return ret
+
+    def is_opus(self) -> bool:
+        return self._is_opus
+
+    def cleanup(self) -> None:
+        if self._subscribed:
+            self._subscribed = False
+            self.broadcast.unsubscribe(self)
+
+
+class BroadcastHub:
+    SPAWNING = object()
+
+    def __init__(self):
+        self._broadcasts: dict[Hashable, object] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(input_id: str, offset: float, *graph: Hashable) -> tuple:
+        # listeners starting a few seconds apart still land on the same decoder
+        return input_id, int(offset // Constants.BROADCAST_OFFSET_BUCKET), *graph
+
+    # returns None while someone else is spawning this very decoder, the caller then opens a private one
+    def open(self, key: Hashable, offset: float, spawn: Callable[[], AudioSource], live: bool,
+             silence: bytes, is_opus: bool) -> Optional[BroadcastAudio]:
+        with self._lock:
+            entry = self._broadcasts.get(key)
+            if isinstance(entry, Broadcast) and entry.can_join(offset):
+                return entry.subscribe(offset, silence, is_opus)
+            if entry is self.SPAWNING:
+                return None
+            # the key is reserved and the spawn, which may wait for a process slot, runs unlocked;
+            # a broadcast that can no longer be joined keeps serving its own subscribers until they leave
+            self._broadcasts[key] = self.SPAWNING
+        try:
+            broadcast = Broadcast(key, spawn(), offset, live, self._release)
+        except BaseException:
+            with self._lock:
+                if self._broadcasts.get(key) is self.SPAWNING:
+                    del self._broadcasts[key]
+            raise
+        with self._lock:
+            self._broadcasts[key] = broadcast
+            return broadcast.subscribe(offset, silence, is_opus)
+
+    def _release(self, broadcast: Broadcast):
+        with self._lock:
+            if broadcast.subscribers:
+                # someone joined between the last unsubscribe and this lock
+                return
+            if self._broadcasts.get(broadcast.key) is broadcast:
+                del self._broadcasts[broadcast.key]
+        broadcast.close()
+
+    def _running(self) -> list[Broadcast]:
+        return [entry for entry in list(self._broadcasts.values()) if isinstance(entry, Broadcast)]
+
+    @property
+    def pipelines(self) -> int:
+        return len(self._running())
+
+    @property
+    def subscribers(self) -> int:
+        return sum(broadcast.subscribers for broadcast in self._running())
+
+
+broadcasts = BroadcastHub()
+
+Gauge('dsplayer_broadcast_pipelines', 'Shared decoders feeding one or more players', lambda: broadcasts.pipelines)
+Gauge('dsplayer_broadcast_subscribers', 'Players reading from a shared decoder', lambda: broadcasts.subscribers)
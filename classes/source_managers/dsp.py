@@ -0,0 +1,130 @@
+from typing import Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from classes.source_managers.audiofilters import AudioFilter, VolumeFilter, DelayFilter, ReverbFilter
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+
+
+class DspStage:
+    # stages are never changed in place, the audio thread may be inside process() while filters change
+    def __init__(self, audio_filter: AudioFilter, previous: Optional['DspStage'] = None):
+        raise NotImplementedError
+
+    def process(self, samples: 'np.ndarray') -> 'np.ndarray':
+        raise NotImplementedError
+
+
+class VolumeStage(DspStage):
+    def __init__(self, audio_filter: VolumeFilter, previous: Optional['VolumeStage'] = None):
+        self.gain = audio_filter.volume
+
+    def process(self, samples):
+        samples *= self.gain
+        return samples
+
+
+class EchoStage(DspStage):
+    # same math as ffmpeg aecho: (in * in_gain + sum(delayed_in * decay)) * out_gain
+
+    def __init__(self, audio_filter: AudioFilter, previous: Optional['EchoStage'] = None):
+        in_gain, out_gain, delays_ms, decays = self._params(audio_filter)
+        self.in_gain, self.out_gain = float(in_gain), float(out_gain)
+        self.delays = [max(int(d * SAMPLE_RATE / 1000), 1) for d in delays_ms]
+        self.decays = decays
+        size = max(self.delays) + SAMPLE_RATE // 10
+        if previous is not None and len(previous._ring) >= size:
+            # the echo tail carries over, at worst missing the frame the audio thread is processing right now
+            self._ring = previous._ring.copy()
+            self._pos = previous._pos % len(self._ring)
+        else:
+            self._ring = np.zeros((size, CHANNELS), dtype=np.float32)
+            self._pos = 0
+
+    @staticmethod
+    def _params(audio_filter: AudioFilter) -> tuple[float, float, list[float], list[float]]:
+        if isinstance(audio_filter, DelayFilter):
+            return (audio_filter.in_gain, audio_filter.out_gain,
+                    [float(i) for i in audio_filter.time_intervals], [float(i) for i in audio_filter.decays])
+        return 1.0, 0.7, [20.0], [0.5]
+
+    def _write(self, samples):
+        size = len(self._ring)
+        n = len(samples)
+        end = self._pos + n
+        if end <= size:
+            self._ring[self._pos:end] = samples
+        else:
+            split = size - self._pos
+            self._ring[self._pos:] = samples[:split]
+            self._ring[:n - split] = samples[split:]
+
+    def _add_delayed(self, out, start: int, decay: float):
+        size = len(self._ring)
+        n = len(out)
+        start %= size
+        end = start + n
+        if end <= size:
+            out += self._ring[start:end] * decay
+        else:
+            split = size - start
+            out[:split] += self._ring[start:] * decay
+            out[split:] += self._ring[:n - split] * decay
+
+    def process(self, samples):
+        if len(samples) + max(self.delays) > len(self._ring):
+            self._ring = np.zeros((max(self.delays) + len(samples), CHANNELS), dtype=np.float32)
+            self._pos = 0
+        self._write(samples)
+        out = samples * self.in_gain
+        for delay, decay in zip(self.delays, self.decays):
+            self._add_delayed(out, self._pos - delay, decay)
+        self._pos = (self._pos + len(samples)) % len(self._ring)
+        out *= self.out_gain
+        return out
+
+
+class DspChain:
+    STAGES = {VolumeFilter: VolumeStage, DelayFilter: EchoStage, ReverbFilter: EchoStage}
+
+    def __init__(self, filters: list[AudioFilter] = None):
+        self._stages: list[tuple[int, DspStage]] = []
+        self.update(filters or [])
+
+    @classmethod
+    def available(cls) -> bool:
+        return np is not None
+
+    @classmethod
+    def supports(cls, audio_filter: AudioFilter) -> bool:
+        return cls.available() and type(audio_filter) in cls.STAGES
+
+    @property
+    def active(self) -> bool:
+        return len(self._stages) > 0
+
+    def update(self, filters: list[AudioFilter]):
+        old = dict(self._stages)
+        stages = []
+        for f in filters:
+            stage_type = self.STAGES[type(f)]
+            previous: Optional[DspStage] = old.get(f.id)
+            # fresh stages built from the old ones' state, nothing the audio thread is using is touched
+            stages.append((f.id, stage_type(f, previous if isinstance(previous, stage_type) else None)))
+        # swapped in one assignment, so the audio thread picks the new chain up on its next frame
+        self._stages = stages
+
+    def process(self, pcm: bytes) -> bytes:
+        stages = self._stages
+        if not stages:
+            return pcm
+        samples = np.frombuffer(pcm, dtype=np.int16).reshape(-1, CHANNELS).astype(np.float32)
+        for _, stage in stages:
+            samples = stage.process(samples)
+        np.clip(samples, -32768, 32767, out=samples)
+        return samples.astype(np.int16).tobytes()
@@ -1,20 +1,37 @@
 import io
+import mmap
+import re
 import shlex
 import subprocess
+import sys
 import threading
+import time
 from abc import ABC
-from typing import Union, Any, Optional, IO
+from concurrent.futures import Future
+from typing import Union, Any, Optional, IO, Callable
 
 import ffmpeg
 from discord import AudioSource, ClientException
+from discord.utils import MISSING
 from discord.opus import Encoder as OpusEncoder
-from wavelink.utils import MISSING
 
-from classes.source_managers.audiofilters import AudioFilter, FilterManager
+from classes import tracing
+from classes.metrics import first_frame_seconds, frame_read_seconds
+from classes.resolver import resolver
+from classes.source_managers.audio_cache import audio_cache
+from classes.source_managers.audiofilters import AudioFilter, FilterManager, VolumeFilter
+from classes.source_managers.broadcast import broadcasts, BroadcastAudio
+from classes.source_managers.dsp import DspChain
+from classes.source_managers.frame_buffer import FrameRingBuffer
+from classes.source_managers.loudness import loudness, LoudnessEstimator
+from classes.source_managers.oggparse import OggStream
+from classes.source_managers.process_supervisor import supervisor, ProcessLimitReached
+from classes.source_managers.remote_audio import audio_workers, RemoteAudio
 from src.const import Constants
 
 
 class FFMPEGAudio(AudioSource, ABC):
+    HTTP_ERROR = re.compile(rb'(?:HTTP error|Server returned) (403|410)')
 
     def __init__(
         self,
@@ -32,6 +49,11 @@ class FFMPEGAudio(AudioSource, ABC):
         self.args = [executable, *args]
         self.kwargs = {"stdout": subprocess.PIPE}
         self.kwargs.update(subprocess_kwargs)
+        if self.kwargs.get("stderr") is None and isinstance(source, str) and source.startswith(('http:', 'https:')):
+            # watched for an expired stream url, see http_error
+            self.kwargs["stderr"] = subprocess.PIPE
+        self._http_error: Optional[int] = None
+        self._stderr_thread: Optional[threading.Thread] = None
         self._init()
 
     def _init(self):
@@ -46,10 +68,33 @@ class FFMPEGAudio(AudioSource, ABC):
             self._pipe_thread = threading.Thread(target=self._pipe_writer, args=(self.source,), daemon=True, name=n)
             self._pipe_thread.start()
 
+        if self.kwargs.get("stderr") == subprocess.PIPE:
+            n = f"popen-stderr-reader:{id(self):#x}"
+            self._stderr_thread = threading.Thread(target=self._stderr_reader, args=(self._process.stderr,),
+                                                   daemon=True, name=n)
+            self._stderr_thread.start()
+
+    def _stderr_reader(self, stream: IO[bytes]) -> None:
+        # ffmpeg's warnings still reach the console, an expired signed url is noted on the way
+        for line in iter(stream.readline, b''):
+            match = self.HTTP_ERROR.search(line)
+            if match:
+                self._http_error = int(match.group(1))
+            sys.stderr.write(line.decode(errors='replace'))
+
+    @property
+    def http_error(self) -> Optional[int]:
+        if self._stderr_thread is not None:
+            # the process is gone by the time this is asked, only its last lines may still be in flight
+            self._stderr_thread.join(0.2)
+        return self._http_error
+
     @staticmethod
     def _spawn_process(args: Any, **subprocess_kwargs: Any) -> subprocess.Popen:
         try:
-            process = subprocess.Popen(args, creationflags=subprocess.CREATE_NO_WINDOW, **subprocess_kwargs)
+            process = supervisor.spawn(args, **subprocess_kwargs)
+        except ProcessLimitReached as exc:
+            raise ClientException(str(exc)) from exc
         except FileNotFoundError:
             executable = args.partition(" ")[0] if isinstance(args, str) else args[0]
             raise ClientException(f"{executable} was not found.") from None
@@ -60,8 +105,9 @@ class FFMPEGAudio(AudioSource, ABC):
 
     def _kill_process(self) -> None:
         proc = self._process
-        if proc is MISSING:
+        if proc is MISSING or proc is None:
             return
+        supervisor.terminate(proc)
 
     def _pipe_writer(self, source: io.BufferedIOBase) -> None:
         while self._process:
@@ -83,6 +129,8 @@ class FFMPEGAudio(AudioSource, ABC):
 
 
 class FFMPEGPCMAudio(FFMPEGAudio):
+    FRAME_DURATION = 0.02
+    SILENCE = b'\x00' * OpusEncoder.FRAME_SIZE
 
     def __init__(
         self,
@@ -95,9 +143,11 @@ class FFMPEGPCMAudio(FFMPEGAudio):
         stderr: Optional[IO[str]] = None,
         before_options: Optional[str] = None,
         options: Optional[str] = None,
-        additional_args: list[str] = None
+        additional_args: list[str] = None,
+        read_ahead: float = 0
     ) -> None:
         self.frame_weight = frame_weight
+        self._buffer: Optional[FrameRingBuffer] = None
         args = []
         subprocess_kwargs = {
             "stdin": subprocess.PIPE if pipe else subprocess.DEVNULL,
@@ -122,23 +172,150 @@ class FFMPEGPCMAudio(FFMPEGAudio):
 
         super().__init__(source, executable=executable, args=args, **subprocess_kwargs)
 
+        if read_ahead > 0:
+            self._buffer = FrameRingBuffer(self._stdout, OpusEncoder.FRAME_SIZE,
+                                           int(read_ahead / self.FRAME_DURATION))
+
+    @property
+    def ready(self) -> bool:
+        return self._buffer is None or self._buffer.fill > 0 or self._buffer.eof
+
+    @property
+    def buffer_stats(self) -> Optional[dict]:
+        return self._buffer.stats if self._buffer else None
+
     def skip_frames(self, frames):
-        self._stdout.read(OpusEncoder.FRAME_SIZE * frames)
-        self.offset += frames
+        if self._buffer:
+            for _ in range(frames):
+                if not self._buffer.pop(Constants.READ_AHEAD_START_TIMEOUT):
+                    break
+        else:
+            self._stdout.read(OpusEncoder.FRAME_SIZE * frames)
+        self.offset += frames * self.frame_weight * self.FRAME_DURATION
+
+    def _read_buffered(self) -> bytes:
+        # only the very first frame may wait for ffmpeg, afterwards a stall is bridged with silence
+        timeout = Constants.READ_AHEAD_START_TIMEOUT if self._buffer.frames_read == 0 else 0
+        ret = self._buffer.pop(timeout)
+        if ret is None:
+            return self.SILENCE
+        if ret:
+            self.offset += self.frame_weight * self.FRAME_DURATION
+        return ret
 
     def read(self, frames=1) -> bytes:
+        if self._buffer:
+            return self._read_buffered()
         ret = self._stdout.read(OpusEncoder.FRAME_SIZE * frames)
-        self.offset += frames * self.frame_weight * 0.02
+        self.offset += frames * self.frame_weight * self.FRAME_DURATION
         if len(ret) != OpusEncoder.FRAME_SIZE:
             return b""
         return ret
 
+    def cleanup(self) -> None:
+        if self._buffer:
+            self._buffer.close()
+        super().cleanup()
+
+    def is_opus(self) -> bool:
+        return False
+
+
+class FFMPEGOpusAudio(FFMPEGAudio):
+    FRAME_DURATION = 0.02
+
+    def __init__(
+        self,
+        source: Union[str, io.BufferedIOBase],
+        *,
+        executable: str = "ffmpeg",
+        frame_weight: float = 1,
+        offset: float = 0,
+        bitrate: int = 128,
+        complexity: int = 10,
+        copy: bool = False,
+        pipe: bool = False,
+        stderr: Optional[IO[str]] = None,
+        before_options: Optional[str] = None,
+        options: Optional[str] = None,
+        additional_args: list[str] = None
+    ) -> None:
+        self.frame_weight = frame_weight
+        args = []
+        subprocess_kwargs = {
+            "stdin": subprocess.PIPE if pipe else subprocess.DEVNULL,
+            "stderr": stderr,
+        }
+
+        if isinstance(before_options, str):
+            args.extend(shlex.split(before_options))
+
+        self.offset = offset
+        args.extend(('-ss', str(offset)))
+
+        args.append("-i")
+        args.append("-" if pipe else source)
+        if copy:
+            # the source is already opus and nothing has to be filtered, so packets are only remuxed
+            args.extend(("-c:a", "copy"))
+        else:
+            args.extend(("-c:a", "libopus", "-b:a", f"{bitrate}k", "-compression_level", str(complexity),
+                         "-frame_duration", "20", "-application", "audio", "-ar", "48000", "-ac", "2"))
+        args.extend(("-map_metadata", "-1", "-f", "opus", "-loglevel", "warning"))
+        args.extend(additional_args or [])
+
+        if isinstance(options, str):
+            args.extend(shlex.split(options))
+
+        args.append("pipe:1")
+
+        super().__init__(source, executable=executable, args=args, **subprocess_kwargs)
+        self._packets = OggStream(self._stdout).iter_packets()
+
+    def read(self) -> bytes:
+        ret = next(self._packets, b"")
+        if ret:
+            self.offset += self.frame_weight * self.FRAME_DURATION
+        return ret
+
+    def is_opus(self) -> bool:
+        return True
+
+
+class MappedPCMAudio(AudioSource):
+    FRAME_DURATION = 0.02
+
+    def __init__(self, path: str, offset: float = 0):
+        self.frame_weight = 1
+        self.offset = offset
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        # seeking a decoded file is just moving the read position
+        self._pos = int(offset / self.FRAME_DURATION) * OpusEncoder.FRAME_SIZE
+
+    def read(self) -> bytes:
+        end = self._pos + OpusEncoder.FRAME_SIZE
+        if end > len(self._map):
+            return b""
+        ret = self._map[self._pos:end]
+        self._pos = end
+        self.offset += self.FRAME_DURATION
+        return ret
+
     def is_opus(self) -> bool:
         return False
 
+    def cleanup(self) -> None:
+        self._map.close()
+        self._file.close()
+
 
 class AudioMeta:
-    def __init__(self, title: str, photo: str = None, author: str = None, duration: int = None):
+    def __init__(self, title: str, photo: str = None, author: str = None, duration: int = None,
+                 codec: str = None, source_id: str = None, sample_rate: int = None):
+        self.sample_rate = sample_rate
+        self.source_id = source_id
+        self.codec = codec
         self.photo = photo
         self.author = author
         self.duration = duration
@@ -147,39 +324,337 @@ class AudioMeta:
 
 class PlayableAudio(AudioSource):
 
-    def __init__(self, source: Union[str, io.BufferedIOBase], filters: list[AudioFilter] = None,
+    # source is None for a lazily resolved track, its stream url is looked up through ref when it is about to play
+    def __init__(self, source: Optional[Union[str, io.BufferedIOBase]], filters: list[AudioFilter] = None,
                  meta_info: AudioMeta = None, **kwargs,):
         self.meta_info = meta_info
+        self.ref = None
         filters = filters or []
-        self._filter_manager = FilterManager(*filters)
+        self._dsp: Optional[DspChain] = None
+        self._gain = 1.0
+        self._estimator: Optional[LoudnessEstimator] = None
+        self._filter_manager = self._filter_manager_for(self._apply_dsp(filters))
         self.source = source
         kwargs.update(**Constants.FFMPEG_CONFIG)
         self._init_kwargs = kwargs
         self._ffmpeg_audio = None
+        self._resolving: Optional[Future] = None
+        self._resolve_started: Optional[float] = None
+        self._pending_offset = 0.0
+        self._refreshes = 0
+        self._awaiting_first_frame = True
+        self._first_read_at: Optional[float] = None
+        self._trace: Optional[tracing.Trace] = None
+        self._spawned_at: Optional[float] = None
+        self.bitrate: Optional[int] = None
 
     @property
     def ffmpeg_audio(self):
-        return self._ffmpeg_audio or self._get_ffmpeg_audio()
+        if self._ffmpeg_audio is None:
+            self._ffmpeg_audio = self._get_ffmpeg_audio(self._pending_offset)
+        return self._ffmpeg_audio
+
+    @property
+    def ready(self) -> bool:
+        if not self.resolved:
+            return False
+        return getattr(self.ffmpeg_audio, 'ready', True)
+
+    @property
+    def resolved(self) -> bool:
+        return self.source is not None
+
+    def _begin_resolve(self, fresh: bool = False) -> Future:
+        if self._resolving is None:
+            self._resolve_started = time.perf_counter()
+            self._resolving = resolver.submit(self.ref.source_name, self.ref.resolve, fresh)
+        return self._resolving
+
+    def _apply_resolved(self, ref):
+        if self.resolved:
+            return
+        if self._trace is not None:
+            self._trace.add_span('resolve:stream', self._resolve_started)
+        self.meta_info = ref.meta_info
+        self.ref = ref
+        self.source = ref.source
+        self._update_gain()
+        # the real sample rate is only known now
+        self._filter_manager = self._filter_manager_for(self._split_filters(self._filters)[0])
+
+    def refresh_source(self, ref) -> bool:
+        # only before the decoder runs, a running one keeps its connection and an expiry is handled in read
+        if self._ffmpeg_audio is not None or not self.resolved:
+            return False
+        self.ref = ref
+        self.source = ref.source
+        return True
+
+    def _stream_expired(self) -> bool:
+        if self.ref is None or self._refreshes >= Constants.STREAM_MAX_REFRESHES:
+            return False
+        if self.meta_info and self.meta_info.duration and self._ffmpeg_audio.offset >= self.meta_info.duration - 1:
+            return False
+        return self.http_error in (403, 410)
 
-    def _get_ffmpeg_audio(self, offset=0.0) -> FFMPEGPCMAudio:
-        print(self._filter_manager.speed)
-        return FFMPEGPCMAudio(source=self.source,
-                              additional_args=self._filter_manager.filter_args,
-                              offset=offset,
-                              frame_weight=self._filter_manager.speed,
-                              **self._init_kwargs)
+    @property
+    def http_error(self) -> Optional[int]:
+        return getattr(self._ffmpeg_audio, 'http_error', None)
+
+    def _refresh_stream(self):
+        # the signed url ran out mid-stream, it is resolved again and playback resumes where it stopped
+        self._refreshes += 1
+        self._pending_offset = self._ffmpeg_audio.offset
+        self._replace_ffmpeg_audio(None)
+        self.source = None
+        self._resolving = None
+        self._begin_resolve(fresh=True)
+
+    def resolve(self, timeout: float = None) -> bool:
+        # blocking, only for threads that may wait (prefetch), the audio thread polls instead
+        if self.resolved:
+            return True
+        try:
+            ref = self._begin_resolve().result(timeout or Constants.RESOLVER_TIMEOUT)
+        except Exception as e:
+            print(e)
+            return False
+        self._apply_resolved(ref)
+        return True
+
+    def _poll_resolved(self) -> Optional[bool]:
+        if self.resolved:
+            return True
+        if not self._begin_resolve().done():
+            return None
+        return self.resolve()
+
+    @property
+    def remaining(self) -> Optional[float]:
+        if self._ffmpeg_audio is None or not self.meta_info or not self.meta_info.duration:
+            return None
+        return self.meta_info.duration - self._ffmpeg_audio.offset
+
+    @property
+    def can_passthrough(self) -> bool:
+        return not self._filter_manager.filter_args and self.meta_info is not None \
+            and self.meta_info.codec == 'opus'
+
+    def _filter_manager_for(self, filters: list[AudioFilter], sample_rate: int = None) -> FilterManager:
+        sample_rate = sample_rate or (self.meta_info.sample_rate if self.meta_info else None)
+        return FilterManager(*filters, sample_rate=sample_rate)
+
+    def _ffmpeg_source(self) -> (str, dict):
+        source_id = self.meta_info.source_id if self.meta_info else None
+        local = audio_cache.lookup(source_id)
+        if local is None:
+            audio_cache.request(source_id, self.source)
+            return self.source, self._init_kwargs
+        if audio_cache.format == 'pcm':
+            return local, {**self._init_kwargs, 'before_options': '-f s16le -ar 48000 -ac 2'}
+        # reconnect options only apply to http inputs
+        return local, {**self._init_kwargs, 'before_options': None}
+
+    def _get_ffmpeg_audio(self, offset=0.0) \
+            -> Union[FFMPEGPCMAudio, FFMPEGOpusAudio, MappedPCMAudio, RemoteAudio]:
+        self._awaiting_first_frame = True
+        self._first_read_at = None
+        if not self.resolved:
+            # spawned on the first read once the stream url is known
+            self._pending_offset = offset
+            self._begin_resolve()
+            return None
+        if self._trace is None:
+            return self._open_ffmpeg_audio(offset)
+        with self._trace.span('spawn', offset=offset):
+            ffmpeg_audio = self._open_ffmpeg_audio(offset)
+        self._spawned_at = time.perf_counter()
+        return ffmpeg_audio
+
+    def _open_ffmpeg_audio(self, offset: float) \
+            -> Union[FFMPEGPCMAudio, FFMPEGOpusAudio, MappedPCMAudio, RemoteAudio, BroadcastAudio]:
+        if Constants.AUDIO_WORKERS > 0:
+            return audio_workers.open(self.source, vars(self.meta_info) if self.meta_info else None,
+                                      self._with_gain(self._filters),
+                                      offset, self.bitrate, self._filter_manager.speed)
+        source, kwargs = self._ffmpeg_source()
+        filter_manager = self._filter_manager
+        copy = self.can_passthrough
+        if source is not self.source and audio_cache.format == 'pcm':
+            if not self.is_opus() and not filter_manager.filter_args:
+                return MappedPCMAudio(source, offset=offset)
+            # the cached file is already decoded to 48 kHz raw pcm, there are no opus packets left to copy
+            filter_manager = self._filter_manager_for(self._split_filters(self._filters)[0], 48000)
+            copy = False
+        if Constants.AUDIO_OUTPUT == 'opus':
+            bitrate = min(self.bitrate or Constants.OPUS_BITRATE, Constants.OPUS_MAX_BITRATE)
+            return self._shared(source, offset, filter_manager, lambda read_ahead: FFMPEGOpusAudio(
+                source=source,
+                additional_args=filter_manager.filter_args,
+                offset=offset,
+                frame_weight=filter_manager.speed,
+                bitrate=bitrate,
+                complexity=Constants.OPUS_COMPLEXITY,
+                copy=copy,
+                **kwargs), bitrate)
+        return self._shared(source, offset, filter_manager, lambda read_ahead: FFMPEGPCMAudio(
+            source=source,
+            additional_args=filter_manager.filter_args,
+            offset=offset,
+            frame_weight=filter_manager.speed,
+            read_ahead=read_ahead,
+            **kwargs))
+
+    def _shared(self, source: str, offset: float, filter_manager: FilterManager,
+                spawn: Callable[[float], AudioSource], bitrate: int = None) -> AudioSource:
+        if not Constants.BROADCAST or not isinstance(source, str):
+            return spawn(Constants.READ_AHEAD_SECONDS)
+        # signed urls differ between lookups of the same track, its source id does not
+        source_id = self.meta_info.source_id if self.meta_info else None
+        input_id = source_id if source is self.source and source_id else source
+        # radio-style inputs have no duration and are joined wherever they are
+        live = not (self.meta_info and self.meta_info.duration)
+        key = broadcasts.key(input_id, offset, tuple(filter_manager.filter_args), bitrate)
+        # the shared buffer does the read-ahead, the decoder itself is read directly
+        shared = broadcasts.open(key, offset, lambda: spawn(0), live, self.silence(), self.is_opus())
+        return shared or spawn(Constants.READ_AHEAD_SECONDS)
+
+    def _replace_ffmpeg_audio(self, ffmpeg_audio: Optional[AudioSource]):
+        old, self._ffmpeg_audio = self._ffmpeg_audio, ffmpeg_audio
+        if old:
+            old.cleanup()
+
+    def _finish_trace(self, **attrs):
+        trace, self._trace = self._trace, None
+        if trace is None:
+            return
+        if self._spawned_at is not None:
+            # everything between the spawn and the first frame is ffmpeg opening and probing the input
+            trace.add_span('first_frame', self._spawned_at, **attrs)
+        trace.release()
 
     def cleanup(self) -> None:
-        if self._ffmpeg_audio:
-            self._ffmpeg_audio.cleanup()
+        self._finish_trace(abandoned=True)
+        self._replace_ffmpeg_audio(None)
 
     def seek_to(self, seconds: float):
-        self._ffmpeg_audio = self._get_ffmpeg_audio(offset=seconds)
+        self._replace_ffmpeg_audio(self._get_ffmpeg_audio(offset=seconds))
+
+    def _with_gain(self, filters: list[AudioFilter]) -> list[AudioFilter]:
+        # loudness normalization rides on the volume filter, in the dsp chain or in ffmpeg's graph
+        if self._gain == 1.0:
+            return list(filters)
+        volume = next((f for f in filters if isinstance(f, VolumeFilter)), None)
+        if volume is None:
+            return [*filters, VolumeFilter(self._gain)]
+        return [VolumeFilter(f.volume * self._gain) if f is volume else f for f in filters]
+
+    def _update_gain(self):
+        source_id = self.meta_info.source_id if self.meta_info else None
+        gain = loudness.gain(source_id)
+        if gain is not None:
+            self._gain, self._estimator = gain, None
+            return
+        if self.resolved:
+            loudness.request(source_id, self.source)
+        # pcm is only seen in-process, opus output plays at unity until the track has been analyzed
+        if self._estimator is None and loudness.enabled and not self.is_opus() and LoudnessEstimator.available():
+            self._estimator = LoudnessEstimator()
+
+    def _split_filters(self, filters: list[AudioFilter]) -> (list[AudioFilter], list[AudioFilter]):
+        filters = self._with_gain(filters)
+        if self.is_opus():
+            return list(filters), []
+        return [f for f in filters if not DspChain.supports(f)], [f for f in filters if DspChain.supports(f)]
+
+    def _apply_dsp(self, filters: list[AudioFilter]) -> list[AudioFilter]:
+        self._filters = list(filters)
+        ffmpeg_filters, dsp_filters = self._split_filters(filters)
+        if self._dsp:
+            self._dsp.update(dsp_filters)
+        elif dsp_filters:
+            self._dsp = DspChain(dsp_filters)
+        return ffmpeg_filters
 
     def set_filters(self, filters: list[AudioFilter]):
-        self._filter_manager = FilterManager(*filters)
-        offset = self._ffmpeg_audio.offset if self._ffmpeg_audio else 0
-        self._ffmpeg_audio = self._get_ffmpeg_audio(offset=offset)
+        filter_manager = self._filter_manager_for(self._apply_dsp(filters))
+        if isinstance(self._ffmpeg_audio, RemoteAudio):
+            # the worker decides itself whether its decoder has to be respawned
+            self._filter_manager = filter_manager
+            self._ffmpeg_audio.set_filters(self._with_gain(self._filters), filter_manager.speed)
+            return
+        if self._ffmpeg_audio and filter_manager.filter_args == self._filter_manager.filter_args:
+            # only in-process filters changed, the running decoder is kept
+            return
+        self._filter_manager = filter_manager
+        offset = self._ffmpeg_audio.offset if self._ffmpeg_audio else self._pending_offset
+        self._replace_ffmpeg_audio(self._get_ffmpeg_audio(offset=offset))
+
+    def is_warm(self, filters: list[AudioFilter]) -> bool:
+        ffmpeg_filters, _ = self._split_filters(filters)
+        return self._ffmpeg_audio is not None and self._ffmpeg_audio.offset == 0 \
+            and self._filter_manager_for(ffmpeg_filters).filter_args == self._filter_manager.filter_args
+
+    def start(self, filters: list[AudioFilter], bitrate: Optional[int] = None, offset: float = 0):
+        self.bitrate = bitrate or self.bitrate
+        self._update_gain()
+        trace = tracing.current()
+        if trace is not None and self._trace is None:
+            # started from a command, the trace stays open until this track produces audio
+            trace.hold()
+            self._trace = trace
+            self._spawned_at = None
+        if offset == 0 and self.is_warm(filters):
+            self._apply_dsp(filters)
+            if self._trace is not None:
+                self._trace.add_span('prefetched', time.perf_counter())
+            return
+        self._filter_manager = self._filter_manager_for(self._apply_dsp(filters))
+        self.seek_to(offset)
 
     def read(self) -> bytes:
-        return self.ffmpeg_audio.read()
+        started = time.perf_counter()
+        if self._ffmpeg_audio is None and not self.resolved:
+            resolved = self._poll_resolved()
+            if resolved is None:
+                # the stream url is still being looked up, the connection is kept fed with silence
+                self._first_read_at = self._first_read_at or started
+                return self.silence()
+            if not resolved:
+                return b''
+        ffmpeg_audio = self.ffmpeg_audio
+        data = ffmpeg_audio.read()
+        if not data and ffmpeg_audio is not self._ffmpeg_audio:
+            # a seek or a filter change closed this decoder mid-read, its successor takes over on the next frame
+            return self.silence()
+        if not data and getattr(ffmpeg_audio, 'detached', False):
+            # dropped by a shared decoder it fell too far behind, playback goes on from where it stopped
+            self._replace_ffmpeg_audio(self._get_ffmpeg_audio(offset=ffmpeg_audio.offset))
+            return self.silence()
+        if not data and self._stream_expired():
+            self._refresh_stream()
+            return self.silence()
+        finished = time.perf_counter()
+        frame_read_seconds.observe(finished - started)
+        if self._awaiting_first_frame:
+            # measured from the first read, a prefetched decoder should not count the time it spent waiting
+            self._first_read_at = self._first_read_at or started
+            if data and data is not FFMPEGPCMAudio.SILENCE and data is not RemoteAudio.OPUS_SILENCE:
+                first_frame_seconds.observe(finished - self._first_read_at)
+                self._awaiting_first_frame = False
+                if self._trace is not None:
+                    self._finish_trace()
+        if self._estimator is not None and data and data is not FFMPEGPCMAudio.SILENCE:
+            gain = self._estimator.feed(data)
+            if gain is not None:
+                self._gain = gain
+                self._apply_dsp(self._filters)
+        if data and self._dsp:
+            return self._dsp.process(data)
+        return data
+
+    def silence(self) -> bytes:
+        return RemoteAudio.OPUS_SILENCE if self.is_opus() else FFMPEGPCMAudio.SILENCE
+
+    def is_opus(self) -> bool:
+        return Constants.AUDIO_OUTPUT == 'opus' or Constants.AUDIO_WORKERS > 0
@@ -0,0 +1,98 @@
+import threading
+from typing import IO, Optional
+
+from classes.metrics import underruns
+
+
+class FrameRingBuffer:
+    def __init__(self, stream: IO[bytes], frame_size: int, capacity: int):
+        self.frame_size = frame_size
+        self.capacity = max(capacity, 1)
+        self._stream = stream
+        self._memory = bytearray(frame_size * self.capacity)
+        view = memoryview(self._memory)
+        self._slots = [view[i * frame_size:(i + 1) * frame_size] for i in range(self.capacity)]
+        self._head = 0
+        self._count = 0
+        self._eof = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self.underruns = 0
+        self.frames_read = 0
+        self.min_fill = self.capacity
+        self._thread = threading.Thread(target=self._fill, daemon=True, name=f'ffmpeg-read-ahead:{id(self):#x}')
+        self._thread.start()
+
+    @property
+    def fill(self) -> int:
+        return self._count
+
+    @property
+    def eof(self) -> bool:
+        return self._eof and self._count == 0
+
+    def _read_frame(self, slot: memoryview) -> int:
+        filled = 0
+        while filled < self.frame_size:
+            n = self._stream.readinto(slot[filled:])
+            if not n:
+                break
+            filled += n
+        return filled
+
+    def _fill(self):
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._count < self.capacity or self._closed)
+                    if self._closed:
+                        return
+                    slot = self._slots[(self._head + self._count) % self.capacity]
+                # the slot is invisible to the consumer until _count grows, so it is filled without the lock
+                filled = self._read_frame(slot)
+                if filled == 0:
+                    return
+                if filled < self.frame_size:
+                    slot[filled:] = bytes(self.frame_size - filled)
+                with self._cond:
+                    self._count += 1
+                    self._cond.notify_all()
+                if filled < self.frame_size:
+                    return
+        except (OSError, ValueError, AttributeError):
+            # the pipe was closed under us by cleanup
+            pass
+        finally:
+            with self._cond:
+                self._eof = True
+                self._cond.notify_all()
+
+    # returns a frame, b'' on a real EOF or None when ffmpeg is stalling
+    def pop(self, timeout: float = 0) -> Optional[bytes]:
+        with self._cond:
+            if self._count == 0 and timeout > 0:
+                self._cond.wait_for(lambda: self._count or self._eof or self._closed, timeout)
+            if self._count == 0:
+                if self._eof or self._closed:
+                    return b''
+                self.underruns += 1
+                underruns.inc()
+                self.min_fill = 0
+                return None
+            data = bytes(self._slots[self._head])
+            self._head = (self._head + 1) % self.capacity
+            self._count -= 1
+            self.frames_read += 1
+            self.min_fill = min(self.min_fill, self._count)
+            self._cond.notify_all()
+            return data
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def stats(self) -> dict:
+        return {'fill': self._count, 'capacity': self.capacity, 'min_fill': self.min_fill,
+                'underruns': self.underruns, 'frames_read': self.frames_read}
@@ -0,0 +1,198 @@
+import math
+import os
+import re
+import shelve
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from classes.metrics import CounterFunction, Gauge
+from classes.source_managers.audio_cache import audio_cache
+from classes.source_managers.process_supervisor import supervisor
+from src.const import Constants
+
+
+def gain_for(loudness: float, peak: Optional[float] = None) -> float:
+    # linear gain towards the target, never boosting the true peak above the ceiling
+    gain_db = Constants.LOUDNESS_TARGET - loudness
+    if peak is not None:
+        gain_db = min(gain_db, Constants.LOUDNESS_TRUE_PEAK - peak)
+    gain_db = max(-Constants.LOUDNESS_MAX_GAIN, min(gain_db, Constants.LOUDNESS_MAX_GAIN))
+    return 10 ** (gain_db / 20)
+
+
+class LoudnessIndex:
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._entries: dict[str, tuple[float, Optional[float]]] = {}
+        self._lock = threading.Lock()
+        self._shelf = None
+
+    @property
+    def shelf(self) -> Optional[shelve.Shelf]:
+        # opened on first use, processes that only import this module never touch the file
+        if self._shelf is None and self.path:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._shelf = shelve.open(self.path)
+        return self._shelf
+
+    def get(self, source_id: str) -> Optional[tuple[float, Optional[float]]]:
+        with self._lock:
+            entry = self._entries.get(source_id)
+            if entry is None and self.shelf is not None:
+                entry = self.shelf.get(source_id)
+                if entry is not None:
+                    self._entries[source_id] = entry
+            return entry
+
+    def put(self, source_id: str, loudness: float, peak: Optional[float]):
+        with self._lock:
+            self._entries[source_id] = (loudness, peak)
+            if self.shelf is not None:
+                self.shelf[source_id] = (loudness, peak)
+                self.shelf.sync()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LoudnessAnalyzer:
+    # integrated loudness (EBU R128) is measured once per track by an ffmpeg run off the playback path
+    INTEGRATED = re.compile(r'Integrated loudness:\s+I:\s+(-?[\d.]+) LUFS')
+    TRUE_PEAK = re.compile(r'True peak:\s+Peak:\s+(-?[\d.]+|-inf) dBFS')
+
+    def __init__(self, index: LoudnessIndex, workers: int = None):
+        self.index = index
+        self.workers = workers or Constants.LOUDNESS_WORKERS
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: set[str] = set()
+        self._lock = threading.Lock()
+        self.analyzed = 0
+        self.failed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return Constants.LOUDNESS_TARGET is not None
+
+    def gain(self, source_id: Optional[str]) -> Optional[float]:
+        entry = self.index.get(source_id) if self.enabled and source_id else None
+        return gain_for(*entry) if entry is not None else None
+
+    def request(self, source_id: Optional[str], url: Optional[str]):
+        if not self.enabled or not source_id or not isinstance(url, str):
+            return
+        if not audio_cache.enabled:
+            self._submit(source_id, url)
+            return
+        local = audio_cache.cached(source_id)
+        if local is None:
+            # measured from the cached copy once it is downloaded, the stream is not fetched a third time
+            audio_cache.request(source_id, url)
+            return
+        self._submit(source_id, local, True)
+
+    def _stored(self, source_id: str, path: str):
+        if self.enabled:
+            self._submit(source_id, path, True)
+
+    def _submit(self, source_id: str, path: str, local: bool = False):
+        with self._lock:
+            if source_id in self._pending or self.index.get(source_id) is not None:
+                return
+            self._pending.add(source_id)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='loudness')
+        self._executor.submit(self._analyze, source_id, path, local)
+
+    @staticmethod
+    def _input_args(path: str, local: bool) -> list[str]:
+        if local and audio_cache.format == 'pcm':
+            return ['-f', 's16le', '-ar', '48000', '-ac', '2', '-i', path]
+        return ['-i', path]
+
+    def _analyze(self, source_id: str, path: str, local: bool):
+        try:
+            process = supervisor.spawn([Constants.FFMPEG_LOCATION, '-nostdin', '-hide_banner', '-nostats',
+                                        *self._input_args(path, local), '-vn',
+                                        '-af', 'ebur128=peak=true', '-f', 'null', '-'],
+                                       stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            try:
+                _, stderr = process.communicate(timeout=Constants.LOUDNESS_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                supervisor.terminate(process)
+                raise
+            # the summary is printed last, per-frame lines before it are ignored
+            summary = stderr.decode(errors='replace').rpartition('Summary:')[2]
+            integrated, peak = self.INTEGRATED.search(summary), self.TRUE_PEAK.search(summary)
+            if process.returncode != 0 or integrated is None:
+                raise ValueError(f'no loudness summary for {source_id}')
+            self.index.put(source_id, float(integrated.group(1)),
+                           float(peak.group(1)) if peak is not None and peak.group(1) != '-inf' else None)
+            self.analyzed += 1
+        except Exception as e:
+            self.failed += 1
+            print(e)
+        finally:
+            with self._lock:
+                self._pending.discard(source_id)
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+
+class LoudnessEstimator:
+    # until a track is analyzed: ungated, unweighted loudness of what has played so far, updated once a second
+    WARMUP_FRAMES = 150
+    UPDATE_FRAMES = 50
+    STEP_DB = 1.0
+    SILENCE = 1e-7  # mean square below -70 LUFS, not counted like R128's absolute gate
+
+    def __init__(self):
+        self._sum = 0.0
+        self._frames = 0
+        self._seen = 0
+        self._peak = 0
+        self.gain = 1.0
+
+    @classmethod
+    def available(cls) -> bool:
+        return np is not None
+
+    def feed(self, pcm: bytes) -> Optional[float]:
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+        mean_square = float(np.dot(samples, samples)) / (len(samples) * 32768.0 ** 2)
+        self._peak = max(self._peak, float(np.abs(samples).max(initial=0)))
+        self._seen += 1
+        if mean_square > self.SILENCE:
+            self._sum += mean_square
+            self._frames += 1
+        if self._frames < self.WARMUP_FRAMES or self._seen % self.UPDATE_FRAMES:
+            return None
+        # both channels add up in R128, the interleaved mean is their average
+        loudness = -0.691 + 10 * math.log10(2 * self._sum / self._frames)
+        # the sample peak seen so far stands in for the true peak, a boost must not clip what already played
+        peak = 20 * math.log10(self._peak / 32768.0)
+        target = 20 * math.log10(gain_for(loudness, peak))
+        current = 20 * math.log10(self.gain)
+        # moved in small steps so a correction is not heard as a jump
+        step = max(-self.STEP_DB, min(target - current, self.STEP_DB))
+        if abs(step) < 0.1:
+            return None
+        self.gain = 10 ** ((current + step) / 20)
+        return self.gain
+
+
+loudness = LoudnessAnalyzer(LoudnessIndex(Constants.LOUDNESS_INDEX_PATH))
+audio_cache.listeners.append(loudness._stored)
+
+CounterFunction('dsplayer_loudness_analyzed_total', 'Tracks measured by the loudness analyzer',
+                lambda: loudness.analyzed)
+CounterFunction('dsplayer_loudness_failed_total', 'Loudness analyses that failed', lambda: loudness.failed)
+Gauge('dsplayer_loudness_pending', 'Tracks waiting for loudness analysis', lambda: loudness.pending)
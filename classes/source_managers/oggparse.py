@@ -0,0 +1,48 @@
+import struct
+from typing import IO, Iterator, Optional
+
+
+class OggError(Exception):
+    pass
+
+
+class OggStream:
+    PAGE_HEADER = struct.Struct('<4sBBqIIIB')
+    OPUS_HEADERS = (b'OpusHead', b'OpusTags')
+
+    def __init__(self, stream: IO[bytes]):
+        self.stream = stream
+
+    def _read_page(self) -> Optional[tuple[bytes, bytes]]:
+        header = self.stream.read(self.PAGE_HEADER.size)
+        if len(header) < self.PAGE_HEADER.size:
+            return None
+        magic, _, _, _, _, _, _, segments = self.PAGE_HEADER.unpack(header)
+        if magic != b'OggS':
+            raise OggError(f'invalid ogg page magic {magic!r}')
+        table = self.stream.read(segments)
+        body = self.stream.read(sum(table))
+        if len(body) < sum(table):
+            return None
+        return table, body
+
+    def iter_packets(self) -> Iterator[bytes]:
+        partial = b''
+        while True:
+            page = self._read_page()
+            if page is None:
+                return
+            table, body = page
+            start = end = 0
+            for lacing in table:
+                end += lacing
+                if lacing == 255:
+                    continue
+                # a packet spanning several pages is glued together with the tail of the previous one
+                packet = partial + body[start:end] if partial else body[start:end]
+                partial = b''
+                start = end
+                if not packet.startswith(self.OPUS_HEADERS):
+                    yield packet
+            if start < end:
+                partial += body[start:end]
@@ -0,0 +1,138 @@
+import asyncio
+import os
+import subprocess
+import threading
+import time
+from typing import Any, Optional
+
+from classes.metrics import Gauge, ffmpeg_spawn_seconds
+from src.const import Constants
+
+
+class ProcessLimitReached(Exception):
+    pass
+
+
+class ProcessSupervisor:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+    def __init__(self, max_processes: int, grace: float, spawn_timeout: float, reap_interval: float = 0.5):
+        self.max_processes = max_processes
+        self.grace = grace
+        self.spawn_timeout = spawn_timeout
+        self.reap_interval = reap_interval
+        self._slots = threading.BoundedSemaphore(max_processes)
+        self._live: dict[int, subprocess.Popen] = {}
+        self._terminating: dict[int, float] = {}
+        self._lock = threading.Lock()
+        self._reaper: Optional[threading.Thread] = None
+        self.spawned = 0
+        self.killed = 0
+
+    def spawn(self, args: Any, timeout: Optional[float] = None, **subprocess_kwargs: Any) -> subprocess.Popen:
+        timeout = self.spawn_timeout if timeout is None else timeout
+        on_loop = self._on_event_loop()
+        started = time.perf_counter()
+        # the event loop never waits for a slot, a full cap there would freeze every guild at once
+        if not self._slots.acquire(timeout=0 if on_loop else timeout):
+            raise ProcessLimitReached(f'{self.max_processes} ffmpeg processes are already running'
+                                      + (', not waiting for one to exit on the event loop' if on_loop else ''))
+        try:
+            process = subprocess.Popen(args, creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0),
+                                       **subprocess_kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._live[process.pid] = process
+            self.spawned += 1
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap, daemon=True, name='ffmpeg-reaper')
+                self._reaper.start()
+        ffmpeg_spawn_seconds.observe(time.perf_counter() - started)
+        return process
+
+    @staticmethod
+    def _on_event_loop() -> bool:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        return True
+
+    def terminate(self, process: subprocess.Popen):
+        with self._lock:
+            if process.pid not in self._live or process.pid in self._terminating:
+                return
+            self._terminating[process.pid] = time.monotonic() + self.grace
+        try:
+            process.terminate()
+        except OSError:
+            pass
+
+    def _release(self, pid: int):
+        with self._lock:
+            process = self._live.pop(pid, None)
+            terminated = self._terminating.pop(pid, None) is not None
+        if process is None:
+            return
+        self._slots.release()
+        if terminated:
+            # nobody reads from a process we stopped, naturally finished ones may still have output in the pipe
+            for stream in (process.stdin, process.stdout, process.stderr):
+                if stream:
+                    try:
+                        stream.close()
+                    except (OSError, ValueError):
+                        pass
+
+    def _reap(self):
+        while True:
+            time.sleep(self.reap_interval)
+            now = time.monotonic()
+            with self._lock:
+                live = list(self._live.items())
+                deadlines = dict(self._terminating)
+            for pid, process in live:
+                if process.poll() is not None:
+                    self._release(pid)
+                elif pid in deadlines and now >= deadlines[pid]:
+                    try:
+                        process.kill()
+                        self.killed += 1
+                    except OSError:
+                        pass
+
+    @property
+    def live(self) -> int:
+        return len(self._live)
+
+    @property
+    def terminating(self) -> int:
+        return len(self._terminating)
+
+    def rss_bytes(self) -> Optional[int]:
+        total = 0
+        with self._lock:
+            pids = list(self._live)
+        for pid in pids:
+            try:
+                with open(f'/proc/{pid}/statm') as f:
+                    total += int(f.read().split()[1]) * self.PAGE_SIZE
+            except (OSError, IndexError, ValueError):
+                if not os.path.exists('/proc'):
+                    return None
+        return total
+
+    @property
+    def stats(self) -> dict:
+        return {'live': self.live, 'terminating': self.terminating, 'max': self.max_processes,
+                'spawned': self.spawned, 'killed': self.killed, 'rss_bytes': self.rss_bytes()}
+
+
+supervisor = ProcessSupervisor(Constants.FFMPEG_MAX_PROCESSES, Constants.FFMPEG_TERMINATE_GRACE,
+                               Constants.FFMPEG_SPAWN_TIMEOUT)
+
+Gauge('dsplayer_ffmpeg_processes', 'Live ffmpeg processes', lambda: supervisor.live)
+Gauge('dsplayer_ffmpeg_terminating', 'ffmpeg processes waiting to exit', lambda: supervisor.terminating)
+Gauge('dsplayer_ffmpeg_rss_bytes', 'Resident memory of all live ffmpeg processes', supervisor.rss_bytes)
@@ -0,0 +1,91 @@
+import importlib
+import threading
+import time
+from typing import Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from classes.source_managers.source_manager import SourceManager
+
+
+class SourceEntry:
+    def __init__(self, name: str, target: str, hosts: tuple[str, ...], prefixes: tuple[str, ...]):
+        self.name = name
+        self.target = target
+        self.hosts = hosts
+        self.prefixes = prefixes
+        self.manager: Optional['SourceManager'] = None
+        self.import_seconds: Optional[float] = None
+
+
+class SourceRegistry:
+    # managers are only named here, their modules (youtube_dl, aiohttp, ...) are imported on first use
+    def __init__(self):
+        self._entries: dict[str, SourceEntry] = {}
+        self._hosts: dict[str, str] = {}
+        self._prefixes: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.default: Optional[str] = None
+
+    def register(self, name: str, target: str, hosts: tuple[str, ...] = (), prefixes: tuple[str, ...] = (),
+                 default: bool = False):
+        self._entries[name] = SourceEntry(name, target, hosts, prefixes)
+        self._hosts.update((host, name) for host in hosts)
+        self._prefixes.update((prefix, name) for prefix in prefixes)
+        if default:
+            self.default = name
+
+    def route(self, query: str) -> Optional[str]:
+        # a dict lookup on the host (or its parent domain) of a url, or on the 'prefix:' of a search query
+        _, sep, rest = query.partition('://')
+        if sep:
+            host = rest.split('/', 1)[0].split('?', 1)[0].rpartition('@')[2].partition(':')[0].lower()
+            name = self._hosts.get(host)
+            if name is None and host.count('.') > 1:
+                name = self._hosts.get(host.split('.', 1)[1])
+            return name
+        prefix, sep, _ = query.partition(':')
+        return self._prefixes.get(prefix.lower()) if sep else None
+
+    def get(self, name: str) -> 'SourceManager':
+        entry = self._entries[name]
+        if entry.manager is None:
+            with self._lock:
+                if entry.manager is None:
+                    started = time.perf_counter()
+                    module_name, _, class_name = entry.target.partition(':')
+                    manager_class = getattr(importlib.import_module(module_name), class_name)
+                    entry.import_seconds = time.perf_counter() - started
+                    entry.manager = manager_class()
+        return entry.manager
+
+    def call(self, name: str, method: str, *args, **kwargs):
+        # meant for resolver threads, so a first-use import never blocks the event loop
+        return getattr(self.get(name), method)(*args, **kwargs)
+
+    def manager_for(self, query: str) -> Optional['SourceManager']:
+        name = self.route(query) or self.default
+        return self.get(name) if name is not None else None
+
+    def loaded(self, name: str) -> bool:
+        entry = self._entries.get(name)
+        return entry is not None and entry.manager is not None
+
+    def preload(self, *names: str) -> threading.Thread:
+        # imports in the background after startup, so neither startup nor the first command pays for it
+        thread = threading.Thread(target=lambda: [self.get(name) for name in names or self._entries],
+                                  daemon=True, name='source-preload')
+        thread.start()
+        return thread
+
+    @property
+    def timings(self) -> dict[str, Optional[float]]:
+        return {name: entry.import_seconds for name, entry in self._entries.items()}
+
+
+sources = SourceRegistry()
+sources.register('youtube', 'classes.source_managers.youtube_manager:YoutubeSourceManager',
+                 hosts=('youtube.com', 'youtu.be', 'music.youtube.com', 'youtube-nocookie.com'),
+                 prefixes=('youtube', 'yt', 'ytsearch'), default=True)
+sources.register('vk', 'classes.source_managers.vk_manager:VkSourceManager',
+                 hosts=('vk.com', 'vk.ru', 'vkontakte.ru'),
+                 prefixes=('vk',))
@@ -0,0 +1,224 @@
+import itertools
+import multiprocessing
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import Connection
+from typing import Optional, Any
+
+from discord import AudioSource
+
+from classes.metrics import underruns
+from src.const import Constants
+
+
+class SharedFrameRing:
+    # single producer (worker) / single consumer (audio thread) ring of length-prefixed frames
+    HEADER = struct.Struct('<QQ')
+    LENGTH = struct.Struct('<H')
+    EOF = 0xFFFF
+    # the end of a stream carries the http status its input failed with, 0 when there was none
+    STATUS = struct.Struct('<H')
+
+    def __init__(self, name: Optional[str] = None, capacity: int = 50, slot_size: int = 1500):
+        self.capacity = capacity
+        self.slot_size = slot_size
+        self._stride = self.LENGTH.size + slot_size
+        size = self.HEADER.size + self._stride * capacity
+        self._shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self._buf = self._shm.buf
+        if name is None:
+            self.HEADER.pack_into(self._buf, 0, 0, 0)
+        self.http_error: Optional[int] = None
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def _seqs(self) -> tuple[int, int]:
+        return self.HEADER.unpack_from(self._buf, 0)
+
+    @property
+    def fill(self) -> int:
+        write_seq, read_seq = self._seqs()
+        return write_seq - read_seq
+
+    def full(self) -> bool:
+        return self.fill >= self.capacity
+
+    def _push(self, length: int, data: bytes = b'') -> bool:
+        write_seq, read_seq = self._seqs()
+        if write_seq - read_seq >= self.capacity:
+            return False
+        pos = self.HEADER.size + (write_seq % self.capacity) * self._stride
+        self.LENGTH.pack_into(self._buf, pos, length)
+        self._buf[pos + self.LENGTH.size:pos + self.LENGTH.size + len(data)] = data
+        # the sequence is published only after the slot is written
+        struct.pack_into('<Q', self._buf, 0, write_seq + 1)
+        return True
+
+    def push(self, data: bytes) -> bool:
+        if len(data) > self.slot_size:
+            raise ValueError(f'frame of {len(data)} bytes does not fit into {self.slot_size} byte slots')
+        return self._push(len(data), data)
+
+    def push_eof(self, http_error: Optional[int] = None) -> bool:
+        return self._push(self.EOF, self.STATUS.pack(http_error or 0))
+
+    # returns a frame, b'' on EOF or None when the ring is empty
+    def pop(self) -> Optional[bytes]:
+        write_seq, read_seq = self._seqs()
+        if read_seq >= write_seq:
+            return None
+        pos = self.HEADER.size + (read_seq % self.capacity) * self._stride
+        (length,) = self.LENGTH.unpack_from(self._buf, pos)
+        if length == self.EOF:
+            (status,) = self.STATUS.unpack_from(self._buf, pos + self.LENGTH.size)
+            self.http_error = status or None
+            data = b''
+        else:
+            data = bytes(self._buf[pos + self.LENGTH.size:pos + self.LENGTH.size + length])
+        struct.pack_into('<Q', self._buf, 8, read_seq + 1)
+        return data
+
+    def close(self):
+        self._buf = None
+        self._shm.close()
+
+    def unlink(self):
+        self._shm.unlink()
+
+
+class AudioWorker:
+    def __init__(self, process: multiprocessing.Process, connection: Connection):
+        self.process = process
+        self.connection = connection
+        self.streams: set[int] = set()
+        self._lock = threading.Lock()
+
+    def send(self, *message: Any):
+        with self._lock:
+            try:
+                self.connection.send(message)
+            except (OSError, EOFError, BrokenPipeError) as e:
+                print(e)
+
+
+class RemoteAudio(AudioSource):
+    FRAME_DURATION = 0.02
+    OPUS_SILENCE = b'\xf8\xff\xfe'
+
+    def __init__(self, pool: 'AudioWorkerPool', worker: AudioWorker, stream_id: int, ring: SharedFrameRing,
+                 offset: float, frame_weight: float):
+        self._pool = pool
+        self._worker = worker
+        self._ring = ring
+        self.stream_id = stream_id
+        self.offset = offset
+        self.frame_weight = frame_weight
+        self.frames_read = 0
+        self.underruns = 0
+        self._closed = False
+
+    @property
+    def ready(self) -> bool:
+        return self._ring.fill > 0
+
+    @property
+    def http_error(self) -> Optional[int]:
+        # forwarded from the worker's decoder, so an expired stream url is refreshed like a local one
+        return self._ring.http_error
+
+    def _pop(self) -> Optional[bytes]:
+        data = self._ring.pop()
+        if data is not None or self.frames_read > 0:
+            return data
+        # the first frame waits for the worker to spawn ffmpeg, like a local decoder would
+        deadline = time.monotonic() + Constants.READ_AHEAD_START_TIMEOUT
+        while data is None and time.monotonic() < deadline and self._worker.process.is_alive():
+            time.sleep(0.005)
+            data = self._ring.pop()
+        return data
+
+    def read(self) -> bytes:
+        if self._closed:
+            return b''
+        data = self._pop()
+        if data is None:
+            if not self._worker.process.is_alive():
+                return b''
+            self.underruns += 1
+            underruns.inc()
+            return self.OPUS_SILENCE
+        if data:
+            self.frames_read += 1
+            self.offset += self.frame_weight * self.FRAME_DURATION
+        return data
+
+    def set_filters(self, filters: list, frame_weight: float):
+        self.frame_weight = frame_weight
+        self._worker.send('filters', self.stream_id, filters)
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._pool.close(self._worker, self.stream_id, self._ring)
+
+
+class AudioWorkerPool:
+    def __init__(self, workers: int):
+        self.size = workers
+        self._workers: list[AudioWorker] = []
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _start_worker(self) -> AudioWorker:
+        # imported here, the worker module pulls in the whole PlayableAudio pipeline
+        from classes.source_managers.audio_worker import worker_main
+        context = multiprocessing.get_context('spawn')
+        parent, child = context.Pipe()
+        process = context.Process(target=worker_main, args=(child,), daemon=True, name='audio-worker')
+        process.start()
+        child.close()
+        return AudioWorker(process, parent)
+
+    def _pick_worker(self) -> AudioWorker:
+        with self._lock:
+            self._workers = [w for w in self._workers if w.process.is_alive()]
+            if len(self._workers) < self.size:
+                self._workers.append(self._start_worker())
+            return min(self._workers, key=lambda w: len(w.streams))
+
+    def open(self, source: str, meta: Optional[dict], filters: list, offset: float, bitrate: Optional[int],
+             frame_weight: float) -> RemoteAudio:
+        worker = self._pick_worker()
+        ring = SharedFrameRing(capacity=Constants.AUDIO_WORKER_BUFFER_FRAMES)
+        stream_id = next(self._ids)
+        worker.streams.add(stream_id)
+        worker.send('open', stream_id, ring.name, ring.capacity, ring.slot_size, source, meta, filters,
+                    offset, bitrate)
+        return RemoteAudio(self, worker, stream_id, ring, offset, frame_weight)
+
+    def close(self, worker: AudioWorker, stream_id: int, ring: SharedFrameRing):
+        worker.streams.discard(stream_id)
+        worker.send('close', stream_id)
+        ring.close()
+        ring.unlink()
+
+    @property
+    def stats(self) -> dict:
+        return {'workers': len(self._workers), 'streams': sum(len(w.streams) for w in self._workers)}
+
+    def shutdown(self):
+        with self._lock:
+            for worker in self._workers:
+                worker.send('shutdown')
+            self._workers = []
+
+
+audio_workers = AudioWorkerPool(Constants.AUDIO_WORKERS)
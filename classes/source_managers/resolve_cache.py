@@ -0,0 +1,114 @@
+import shelve
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlsplit, parse_qs
+
+from classes.metrics import CounterFunction
+from classes.source_managers.track_ref import TrackRef
+from src.const import Constants
+
+
+class ResolveCache:
+    def __init__(self, max_size: int = None, path: Optional[str] = None):
+        self.max_size = max_size or Constants.RESOLVE_CACHE_SIZE
+        self._entries: OrderedDict[str, tuple[float, list[TrackRef]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._shelf = shelve.open(path) if path else None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        query = ' '.join(query.split())
+        if '://' in query:
+            # urls are case sensitive (youtube ids), only the fragment is dropped
+            return query.split('#')[0]
+        return query.lower()
+
+    @staticmethod
+    def url_expiry(url: str) -> Optional[float]:
+        params = parse_qs(urlsplit(url).query)
+        for key in ('expire', 'expires'):
+            if key in params:
+                try:
+                    return float(params[key][0])
+                except ValueError:
+                    return None
+        return None
+
+    def key(self, source_name: str, query: str) -> str:
+        return f'{source_name}:{self.normalize(query)}'
+
+    def get(self, source_name: str, query: str) -> Optional[list[TrackRef]]:
+        key = self.key(source_name, query)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._shelf is not None:
+                entry = self._shelf.get(key)
+                if entry is not None:
+                    self._store(key, entry)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            return None
+
+    def put(self, source_name: str, query: str, tracks: list[TrackRef], ttl: float):
+        now = time.time()
+        expires_at = now + ttl
+        for track in tracks:
+            # signed stream urls carry their own expiry, never keep an entry past it
+            if not track.resolved:
+                continue
+            url_expiry = self.url_expiry(track.source)
+            if url_expiry is not None:
+                expires_at = min(expires_at, url_expiry - Constants.RESOLVE_CACHE_EXPIRY_MARGIN)
+        if expires_at <= now:
+            return
+        key = self.key(source_name, query)
+        entry = (expires_at, tracks)
+        with self._lock:
+            self._store(key, entry)
+            if self._shelf is not None:
+                self._shelf[key] = entry
+                self._shelf.sync()
+
+    def _store(self, key: str, entry: tuple[float, list[TrackRef]]):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            old_key, _ = self._entries.popitem(last=False)
+            if self._shelf is not None and old_key in self._shelf:
+                del self._shelf[old_key]
+
+    def _drop(self, key: str):
+        self._entries.pop(key, None)
+        if self._shelf is not None and key in self._shelf:
+            del self._shelf[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._shelf is not None:
+                self._shelf.clear()
+
+    @property
+    def size(self) -> int:
+        return len(self._entries)
+
+    def close(self):
+        if self._shelf is not None:
+            self._shelf.close()
+            self._shelf = None
+
+
+resolve_cache = ResolveCache(path=Constants.RESOLVE_CACHE_PATH)
+
+CounterFunction('dsplayer_resolve_cache_hits_total', 'Resolve cache hits', lambda: resolve_cache.hits)
+CounterFunction('dsplayer_resolve_cache_misses_total', 'Resolve cache misses', lambda: resolve_cache.misses)
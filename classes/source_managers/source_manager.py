@@ -2,23 +2,38 @@ import re
 from abc import ABCMeta, abstractmethod
 from typing import Optional
 
-from classes.source_managers.ffmpeg_audio import PlayableAudio, AudioMeta
+from classes.source_managers.ffmpeg_audio import AudioMeta
+from classes.source_managers.track_ref import TrackRef
+
+
+URL_PATTERN = re.compile(
+    r'^(?:http|ftp)s?://'  # http:// or https://
+    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'  # domain...
+    r'localhost|'  # localhost...
+    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # ...or ip
+    r'(?::\d+)?'  # optional port
+    r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+
+
+class SourceError(Exception):
+    pass
 
 
 class Playlist:
-    def __init__(self, tracks: list[PlayableAudio], info: Optional[AudioMeta]):
+    def __init__(self, tracks: list[TrackRef], info: Optional[AudioMeta]):
         self.tracks = tracks
         self.info = info
 
 
 class SourceManager(metaclass=ABCMeta):
+    name: str = None
 
     @abstractmethod
-    def get_track(self, query) -> PlayableAudio:
+    def get_track(self, query) -> TrackRef:
         pass
 
     @abstractmethod
-    def search_tracks(self, query) -> list[PlayableAudio]:
+    def search_tracks(self, query) -> list[TrackRef]:
         pass
 
     @abstractmethod
@@ -27,12 +42,4 @@ class SourceManager(metaclass=ABCMeta):
 
     @staticmethod
     def validate_url(url):
-        regex = re.compile(
-            r'^(?:http|ftp)s?://'  # http:// or https://
-            r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'  # domain...
-            r'localhost|'  # localhost...
-            r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # ...or ip
-            r'(?::\d+)?'  # optional port
-            r'(?:/?|[/?]\S+)$', re.IGNORECASE)
-
-        return re.match(regex, url) is not None
+        return URL_PATTERN.match(url) is not None
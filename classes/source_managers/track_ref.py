@@ -0,0 +1,57 @@
+from typing import Optional, Callable
+
+from classes.source_managers.ffmpeg_audio import PlayableAudio, AudioMeta
+from classes.source_managers.registry import sources
+
+
+class TrackRef:
+    # a queued track costs only these fields until it is about to play
+    __slots__ = ('source', 'source_id', 'title', 'author', 'duration', 'photo', 'codec', 'sample_rate')
+
+    # a source manager registers here how its references get a (fresh, bypassing caches) stream url, in bulk
+    resolvers: dict[str, Callable[[list['TrackRef'], bool], list['TrackRef']]] = {}
+
+    def __init__(self, source: Optional[str], title: str, author: str = None, duration: int = None, photo: str = None,
+                 source_id: str = None, codec: str = None, sample_rate: int = None):
+        self.source = source
+        self.source_id = source_id
+        self.title = title
+        self.author = author
+        self.duration = duration
+        self.photo = photo
+        self.codec = codec
+        self.sample_rate = sample_rate
+
+    @property
+    def resolved(self) -> bool:
+        return self.source is not None
+
+    @property
+    def source_name(self) -> Optional[str]:
+        return self.source_id.split(':', 1)[0] if self.source_id else None
+
+    def resolve(self, fresh: bool = False) -> 'TrackRef':
+        if self.resolved and not fresh:
+            return self
+        if self.source_name not in self.resolvers:
+            # importing the manager registers its resolver
+            sources.get(self.source_name)
+        return self.resolvers[self.source_name]([self], fresh)[0]
+
+    @property
+    def meta_info(self) -> AudioMeta:
+        return AudioMeta(self.title, photo=self.photo, author=self.author, duration=self.duration,
+                         codec=self.codec, source_id=self.source_id, sample_rate=self.sample_rate)
+
+    @classmethod
+    def from_playable(cls, audio: PlayableAudio) -> Optional['TrackRef']:
+        meta = audio.meta_info
+        if meta is None or not isinstance(audio.source, str):
+            return None
+        return cls(audio.source, meta.title, author=meta.author, duration=meta.duration, photo=meta.photo,
+                   source_id=meta.source_id, codec=meta.codec, sample_rate=meta.sample_rate)
+
+    def to_playable(self) -> PlayableAudio:
+        audio = PlayableAudio(self.source, meta_info=self.meta_info)
+        audio.ref = self
+        return audio
@@ -1,71 +1,229 @@
-from classes.source_managers.ffmpeg_audio import PlayableAudio, AudioMeta
-from classes.source_managers.source_manager import SourceManager, Playlist
-import requests
+import asyncio
+import concurrent.futures
+import random
+from typing import Callable, AsyncIterator, Optional, Coroutine
+
+import aiohttp
+
+from classes.rate_limit import TokenBucket
+from classes.source_managers.ffmpeg_audio import PlayableAudio
+from classes.source_managers.resolve_cache import resolve_cache
+from classes.source_managers.source_manager import SourceManager, Playlist, SourceError
+from classes.source_managers.track_ref import TrackRef
 
 from src.const import Constants
 
 
+class VkApiError(SourceError):
+    def __init__(self, code: Optional[int], message: str):
+        super().__init__(f'{code}: {message}')
+        self.code = code
+
+
 class VkApi:
-    def __init__(self, token):
+    # too many requests per second, flood control, internal server error
+    RETRY_ERRORS = {6, 9, 10}
+    BY_ID_CHUNK = 100
+
+    def __init__(self, token, base_url: str = None, concurrency: int = None, rate: float = None,
+                 retries: int = None, backoff: float = None):
         self.token = token
+        self.base_url = (base_url or Constants.VK_API_URL).rstrip('/')
         self.params = {
             'access_token': self.token,
-            'count': 10000,
             'v': '5.111'
         }
+        self.concurrency = concurrency or Constants.VK_API_CONCURRENCY
+        self.retries = Constants.VK_API_RETRIES if retries is None else retries
+        self.backoff = Constants.VK_API_BACKOFF if backoff is None else backoff
+        self._bucket = TokenBucket(rate or Constants.VK_API_RATE, self.concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        # the bot's event loop, resolver threads hand their calls over to it
+        self._loop = loop
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is not None and self._session_loop is not loop:
+            # the event loop was replaced, the old session is closed where it lives
+            await self._close_session(self._session, self._session_loop)
+            self._session = None
+        if self._session is None or self._session.closed:
+            # every page and playlist request reuses the same keep-alive connections
+            connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=Constants.VK_API_KEEPALIVE)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=Constants.VK_API_TIMEOUT))
+            self._session_loop = loop
+        self._loop = loop
+        return self._session
+
+    @staticmethod
+    async def _close_session(session: aiohttp.ClientSession, loop: asyncio.AbstractEventLoop):
+        if loop.is_closed():
+            # its connections went down with the loop, there is nothing left to close them on
+            session.detach()
+            return
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(session.close(), loop))
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def call(self, method: str, **params) -> dict:
+        attempt = 0
+        while True:
+            await self._bucket.acquire()
+            try:
+                session = await self._get_session()
+                async with session.get(f'{self.base_url}/{method}', params={**self.params, **params}) as resp:
+                    if resp.status == 429 or resp.status >= 500:
+                        error = VkApiError(None, f'HTTP {resp.status}')
+                    else:
+                        data = await resp.json(content_type=None)
+                        if 'error' not in data:
+                            return data['response']
+                        error = VkApiError(data['error'].get('error_code'), data['error'].get('error_msg'))
+                        if error.code not in self.RETRY_ERRORS:
+                            raise error
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            if attempt >= self.retries:
+                raise error
+            await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(1, 1.5))
+            attempt += 1
+
+    def call_sync(self, coro: Coroutine, timeout: float = None):
+        # for resolver threads, a session on a throwaway loop would outlive it unclosed
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            coro.close()
+            raise VkApiError(None, 'the vk api is not bound to the bot event loop yet')
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        try:
+            return future.result(timeout or Constants.RESOLVER_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise VkApiError(None, f'no answer within {timeout or Constants.RESOLVER_TIMEOUT}s') from None
+
+    async def get_audio_by_id(self, ids: list[str]) -> list[dict]:
+        chunks = [ids[i:i + self.BY_ID_CHUNK] for i in range(0, len(ids), self.BY_ID_CHUNK)]
+        responses = await asyncio.gather(*(self.call('audio.getById', audios=','.join(chunk)) for chunk in chunks))
+        return [item for response in responses for item in response]
+
+    async def get_audio_page(self, params: dict, offset: int, count: int) -> (list[dict], int):
+        response = await self.call('audio.get', **params, offset=offset, count=count)
+        return response['items'], response.get('count', 0)
+
+    async def iter_audio(self, params: dict, page_size: int = None) -> AsyncIterator[list[dict]]:
+        page_size = page_size or Constants.VK_PAGE_SIZE
+        items, total = await self.get_audio_page(params, 0, page_size)
+        if items:
+            yield items
+        if len(items) < page_size:
+            return
+        # the first page tells the total, the rest is fetched concurrently and still yielded in order
+        pages = [asyncio.ensure_future(self.get_audio_page(params, offset, page_size))
+                 for offset in range(len(items), total, page_size)]
+        try:
+            for page in pages:
+                items, _ = await page
+                if items:
+                    yield items
+        finally:
+            for page in pages:
+                page.cancel()
 
-    def get_user_audio(self, user_id):
-        params = self.params.copy()
-        params['user_id'] = user_id
-        resp = requests.get('https://api.vk.com/method/audio.get', params=params).json()
-        tracks = [VkSourceManager.to_playable_audio(**item) for item in resp['response']['items']]
-        playlist = Playlist(tracks, None)
-        return playlist
+    def iter_user_audio(self, user_id) -> AsyncIterator[list[dict]]:
+        return self.iter_audio({'user_id': user_id})
 
-    def get_playlist_audio(self, playlist_link: str):
+    def iter_playlist_audio(self, playlist_link: str) -> AsyncIterator[list[dict]]:
         pid = 0
         poid = 0
         if 'audio_playlist' in playlist_link:
             (poid, pid) = playlist_link.split('audio_playlist')[1].split('%')[0].split('&')[0].split('_')
         elif 'album' in playlist_link:
-            (poid, pid) = playlist_link.split('album/')[1].split('_')[0:1]
-        params = self.params.copy()
-        params['album_id'] = pid
-        params['owner_id'] = poid
-        print(params)
-        resp = requests.get('https://api.vk.com/method/audio.get', params=params).json()
-        tracks = [VkSourceManager.to_playable_audio(**item) for item in resp['response']['items']]
-        playlist = Playlist(tracks, None)
-        return playlist
+            (poid, pid) = playlist_link.split('album/')[1].split('_')[0:2]
+        return self.iter_audio({'album_id': pid, 'owner_id': poid})
+
+    async def get_user_audio(self, user_id) -> list[dict]:
+        return [item async for page in self.iter_user_audio(user_id) for item in page]
+
+    async def get_playlist_audio(self, playlist_link: str) -> list[dict]:
+        return [item async for page in self.iter_playlist_audio(playlist_link) for item in page]
+
+    async def get_playlists_audio(self, playlist_links: list[str]) -> list[list[dict]]:
+        return list(await asyncio.gather(*(self.get_playlist_audio(link) for link in playlist_links)))
 
 
 class VkSourceManager(SourceManager):
+    name = 'vk'
 
     vk_api = VkApi(Constants.VK_TOKEN)
 
     @classmethod
-    def to_playable_audio(cls, **kwargs):
-        info = AudioMeta(kwargs['title'])
-        source = kwargs['url']
-        info.author = kwargs['artist']
-        info.duration = kwargs['duration']
+    def to_track_ref(cls, **kwargs) -> TrackRef:
         thumb = None
         album = kwargs.get('album')
         if album is not None:
             thumb = album.get('thumb')
 
-        if thumb is not None:
-            info.photo = thumb['photo_1200']
-        return PlayableAudio(source, meta_info=info)
+        return TrackRef(kwargs['url'], kwargs['title'],
+                        author=kwargs['artist'],
+                        duration=kwargs['duration'],
+                        photo=thumb['photo_1200'] if thumb is not None else None,
+                        source_id=f"{cls.name}:{kwargs['owner_id']}_{kwargs['id']}",
+                        sample_rate=Constants.VK_SAMPLE_RATE)
 
-    def get_track(self, query) -> PlayableAudio:
+    @classmethod
+    def to_playable_audio(cls, **kwargs) -> PlayableAudio:
+        return cls.to_track_ref(**kwargs).to_playable()
+
+    async def _iter_resolve(self, query: str, fetch_pages: Callable[[], AsyncIterator[list[dict]]]) \
+            -> AsyncIterator[list[TrackRef]]:
+        # cached tracks may be re-signed later from a resolver thread, which runs on this loop
+        self.vk_api.bind(asyncio.get_running_loop())
+        tracks = resolve_cache.get(self.name, query)
+        if tracks is not None:
+            yield tracks
+            return
+        tracks = []
+        async for items in fetch_pages():
+            page = [self.to_track_ref(**item) for item in items]
+            tracks.extend(page)
+            yield page
+        resolve_cache.put(self.name, query, tracks, Constants.VK_STREAM_TTL)
+
+    @classmethod
+    def resolve_streams(cls, refs: list[TrackRef], fresh: bool = False) -> list[TrackRef]:
+        # vk urls are signed as well, getById signs them again for the same tracks
+        items = cls.vk_api.call_sync(cls.vk_api.get_audio_by_id([ref.source_id.split(':', 1)[1] for ref in refs]))
+        fresh_refs = {ref.source_id: ref for ref in (cls.to_track_ref(**item) for item in items)}
+        return [fresh_refs.get(ref.source_id, ref) for ref in refs]
+
+    def get_track(self, query) -> TrackRef:
         pass
 
-    def search_tracks(self, query) -> list[PlayableAudio]:
+    def search_tracks(self, query) -> list[TrackRef]:
         pass
 
-    def get_playlist(self, query):
-        return self.vk_api.get_playlist_audio(query)
+    def iter_playlist(self, query) -> AsyncIterator[list[TrackRef]]:
+        return self._iter_resolve(query, lambda: self.vk_api.iter_playlist_audio(query))
+
+    def iter_user(self, uid) -> AsyncIterator[list[TrackRef]]:
+        return self._iter_resolve(f'user:{uid}', lambda: self.vk_api.iter_user_audio(uid))
+
+    async def get_playlist(self, query):
+        return Playlist([t async for page in self.iter_playlist(query) for t in page], None)
+
+    async def get_playlists(self, queries: list[str]) -> list[Playlist]:
+        return list(await asyncio.gather(*(self.get_playlist(q) for q in queries)))
+
+    async def get_user(self, uid):
+        return Playlist([t async for page in self.iter_user(uid) for t in page], None)
+
 
-    def get_user(self, uid):
-        return self.vk_api.get_user_audio(uid)
+TrackRef.resolvers[VkSourceManager.name] = VkSourceManager.resolve_streams
@@ -1,10 +1,14 @@
 import youtube_dl
 
-from classes.source_managers.ffmpeg_audio import PlayableAudio, AudioMeta
+from classes.source_managers.ffmpeg_audio import PlayableAudio
+from classes.source_managers.resolve_cache import resolve_cache
 from classes.source_managers.source_manager import SourceManager, Playlist
+from classes.source_managers.track_ref import TrackRef
+from src.const import Constants
 
 
 class YoutubeSourceManager(SourceManager):
+    name = 'youtube'
     format_options = {
         'format': 'bestaudio/best',
         'outtmpl': '%(extractor)s-%(id)s-%(title)s.%(ext)s',
@@ -18,34 +22,66 @@ class YoutubeSourceManager(SourceManager):
         'default_search': 'auto',
         'source_address': '0.0.0.0'
     }
+    # result lists only need titles, the stream url of a track is resolved once it is about to play
+    flat_options = {**format_options, 'extract_flat': 'in_playlist'}
+
+    @classmethod
+    def to_track_ref(cls, **kwargs) -> TrackRef:
+        return TrackRef(kwargs['url'], kwargs['title'],
+                        author=kwargs['channel'],
+                        duration=kwargs['duration'],
+                        photo=kwargs['thumbnail'],
+                        source_id=f"{cls.name}:{kwargs['id']}",
+                        codec=kwargs.get('acodec'),
+                        sample_rate=kwargs.get('asr'))
+
+    @classmethod
+    def to_flat_track_ref(cls, **kwargs) -> TrackRef:
+        video_id = kwargs['id']
+        return TrackRef(None, kwargs.get('title'),
+                        author=kwargs.get('channel') or kwargs.get('uploader'),
+                        duration=kwargs.get('duration'),
+                        photo=kwargs.get('thumbnail') or f'https://i.ytimg.com/vi/{video_id}/hqdefault.jpg',
+                        source_id=f'{cls.name}:{video_id}')
 
     @classmethod
     def to_playable_audio(cls, **kwargs) -> PlayableAudio:
-        info = AudioMeta(kwargs['title'])
-        source = kwargs['url']
-        info.duration = kwargs['duration']
-        info.author = kwargs['channel']
-        info.photo = kwargs['thumbnail']
-        return PlayableAudio(source, meta_info=info)
+        return cls.to_track_ref(**kwargs).to_playable()
 
     @classmethod
-    def search_youtube(cls, query, count):
-        with youtube_dl.YoutubeDL(cls.format_options) as ydl:
-            if not cls.validate_url(query):
-                result = ydl.extract_info(f"ytsearch{count}:{query}", download=False)
-                elements = result['entries']
-            else:
-                elements = [ydl.extract_info(query, download=False)]
-        elements = [cls.to_playable_audio(**e) for e in elements]
-        return elements
+    def search_youtube(cls, query, count, flat=False, fresh=False):
+        # a url is a single video, flat extraction only makes a difference for result lists
+        flat = flat and not cls.validate_url(query)
+        cache_name = f'{cls.name}:flat:{count}' if flat else f'{cls.name}:{count}'
+        tracks = None if fresh else resolve_cache.get(cache_name, query)
+        if tracks is None:
+            with youtube_dl.YoutubeDL(cls.flat_options if flat else cls.format_options) as ydl:
+                if not cls.validate_url(query):
+                    result = ydl.extract_info(f"ytsearch{count}:{query}", download=False)
+                    elements = result['entries']
+                else:
+                    elements = [ydl.extract_info(query, download=False)]
+            to_track_ref = cls.to_flat_track_ref if flat else cls.to_track_ref
+            tracks = [to_track_ref(**e) for e in elements]
+            resolve_cache.put(cache_name, query, tracks, Constants.YOUTUBE_STREAM_TTL)
+        return tracks
 
     @classmethod
-    def get_track(cls, query) -> PlayableAudio:
+    def resolve_streams(cls, refs: list[TrackRef], fresh: bool = False) -> list[TrackRef]:
+        return [cls.search_youtube(f"https://www.youtube.com/watch?v={ref.source_id.split(':', 1)[1]}", 1,
+                                   fresh=fresh)[0]
+                for ref in refs]
+
+    @classmethod
+    def get_track(cls, query) -> TrackRef:
         return cls.search_youtube(query, 1)[0]
 
     @classmethod
-    def search_tracks(cls, query) -> list[PlayableAudio]:
-        return cls.search_youtube(query, 30)
+    def search_tracks(cls, query) -> list[TrackRef]:
+        return cls.search_youtube(query, 30, flat=True)
 
     def get_playlist(self, query) -> Playlist:
         pass
+
+
+TrackRef.resolvers[YoutubeSourceManager.name] = YoutubeSourceManager.resolve_streams
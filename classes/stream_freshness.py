@@ -0,0 +1,76 @@
+import asyncio
+import time
+from typing import Optional, Callable, Iterable
+
+from classes.metrics import CounterFunction
+from classes.player import FFMPEGPlayer, QueueEntry
+from classes.resolver import resolver
+from classes.source_managers.resolve_cache import ResolveCache
+from classes.source_managers.track_ref import TrackRef
+from src.const import Constants
+
+
+class StreamFreshness:
+    # signed stream urls of queued tracks are resolved again in the background before they would expire
+    def __init__(self, window: float = None, interval: float = None, margin: float = None):
+        self.window = window or Constants.STREAM_REFRESH_WINDOW
+        self.interval = interval or Constants.STREAM_REFRESH_INTERVAL
+        self.margin = Constants.STREAM_REFRESH_MARGIN if margin is None else margin
+        self._task: Optional[asyncio.Task] = None
+        self.refreshed = 0
+
+    @staticmethod
+    def _ref(entry: QueueEntry) -> Optional[TrackRef]:
+        return entry if isinstance(entry, TrackRef) else entry.ref
+
+    def due(self, player: FFMPEGPlayer, now: float = None) -> list[TrackRef]:
+        now = now or time.time()
+        current = player.source
+        eta = (current.remaining or 0) if current is not None else 0
+        due = []
+        for entry in player.queue.snapshot(0, Constants.STREAM_REFRESH_SCAN):
+            if eta > self.window:
+                break
+            ref = self._ref(entry)
+            duration = (ref.duration if ref is not None else None) or 0
+            if ref is not None and ref.resolved and ref.source_name in TrackRef.resolvers:
+                expires_at = ResolveCache.url_expiry(ref.source)
+                # the url has to outlive the whole track, ffmpeg may reconnect near its end
+                if expires_at is not None and expires_at < now + eta + duration + self.margin:
+                    due.append(ref)
+            eta += duration
+        return due
+
+    async def refresh(self, player: FFMPEGPlayer) -> int:
+        by_source: dict[str, list[TrackRef]] = {}
+        for ref in self.due(player):
+            by_source.setdefault(ref.source_name, []).append(ref)
+        refreshed = 0
+        for source_name, refs in by_source.items():
+            try:
+                fresh = await resolver.run(source_name, TrackRef.resolvers[source_name], refs, True)
+            except Exception as e:
+                print(e)
+                continue
+            refreshed += player.queue.refresh({ref.source_id: ref for ref in fresh if ref.resolved})
+        self.refreshed += refreshed
+        return refreshed
+
+    def ensure_running(self, players: Callable[[], Iterable[FFMPEGPlayer]]):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run(players))
+
+    async def _run(self, players: Callable[[], Iterable[FFMPEGPlayer]]):
+        while True:
+            await asyncio.sleep(self.interval)
+            current = list(players())
+            if not current:
+                return
+            for player in current:
+                await self.refresh(player)
+
+
+stream_freshness = StreamFreshness()
+
+CounterFunction('dsplayer_stream_refreshes_total', 'Queued stream urls resolved again before they expired',
+                lambda: stream_freshness.refreshed)
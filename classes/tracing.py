@@ -0,0 +1,155 @@
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Iterator
+
+from src.const import Constants
+
+
+class Span:
+    __slots__ = ('name', 'start', 'end', 'attrs')
+
+    def __init__(self, name: str, start: float, end: Optional[float] = None, **attrs):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.attrs = attrs
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+
+class Trace:
+    _ids = itertools.count(1)
+
+    def __init__(self, name: str, **attrs):
+        self.id = next(self._ids)
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.spans: list[Span] = []
+        # the command itself holds the trace, a track that is started from it holds it until its first frame
+        self._holds = 1
+        self._lock = threading.Lock()
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    @contextmanager
+    def span(self, name: str, **attrs) -> Iterator[Span]:
+        span = Span(name, time.perf_counter(), **attrs)
+        try:
+            yield span
+        except BaseException as e:
+            span.attrs['error'] = repr(e)
+            raise
+        finally:
+            span.end = time.perf_counter()
+            self.spans.append(span)
+
+    def add_span(self, name: str, start: float, end: float = None, **attrs):
+        self.spans.append(Span(name, start, end or time.perf_counter(), **attrs))
+
+    def hold(self):
+        with self._lock:
+            self._holds += 1
+
+    def release(self):
+        with self._lock:
+            self._holds -= 1
+            if self._holds != 0:
+                return
+            self.end = time.perf_counter()
+        tracer.record(self)
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration * 1000, 2),
+            'attrs': self.attrs,
+            'spans': [{'name': s.name,
+                       'offset_ms': round((s.start - self.start) * 1000, 2),
+                       'duration_ms': round(s.duration * 1000, 2),
+                       **({'attrs': s.attrs} if s.attrs else {})}
+                      for s in sorted(self.spans, key=lambda s: s.start)],
+        }
+
+
+class Tracer:
+    def __init__(self, size: int, path: Optional[str] = None, slow_threshold: Optional[float] = None):
+        self.path = path
+        self.slow_threshold = slow_threshold
+        self._traces: deque[Trace] = deque(maxlen=size)
+        # finished traces are written out here so the audio thread never touches the disk
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='trace-writer')
+
+    def record(self, trace: Trace):
+        self._traces.append(trace)
+        slow = self.slow_threshold is not None and trace.duration >= self.slow_threshold
+        if self.path or slow:
+            self._writer.submit(self._write, trace, slow)
+
+    def _write(self, trace: Trace, slow: bool):
+        data = trace.to_dict()
+        if slow:
+            spans = ', '.join(f"{s['name']}={s['duration_ms']:.0f}ms" for s in data['spans'])
+            print(f"slow {trace.name} ({data['duration_ms']:.0f}ms) {trace.attrs}: {spans}")
+        if self.path:
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(data, ensure_ascii=False, default=str) + '\n')
+            except OSError as e:
+                print(e)
+
+    def recent(self, count: int = None) -> list[dict]:
+        traces = list(self._traces)
+        return [t.to_dict() for t in traces[-count if count else 0:]]
+
+
+tracer = Tracer(Constants.TRACE_BUFFER_SIZE, Constants.TRACE_PATH, Constants.TRACE_SLOW_SECONDS)
+
+_current: ContextVar[Optional[Trace]] = ContextVar('trace', default=None)
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def trace(name: str, **attrs) -> Iterator[Trace]:
+    t = Trace(name, **attrs)
+    token = _current.set(t)
+    try:
+        yield t
+    except BaseException as e:
+        t.attrs['error'] = repr(e)
+        raise
+    finally:
+        _current.reset(token)
+        t.release()
+
+
+def detach():
+    # background work spawned by a traced command inherits its context but is not part of its trace
+    _current.set(None)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Optional[Span]]:
+    t = current()
+    if t is None:
+        yield None
+        return
+    with t.span(name, **attrs) as s:
+        yield s
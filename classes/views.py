@@ -4,9 +4,8 @@ from typing import Dict, Any, Optional
 
 from discord import Interaction, Embed, ButtonStyle
 from discord.ui import View, Item, Button, Modal, InputText
-from wavelink import Player
-from wavelink.abc import Playable
 
+from classes.message_renderer import renderer
 from classes.player import FFMPEGPlayer
 from classes.source_managers.audiofilters import *
 from classes.source_managers.ffmpeg_audio import PlayableAudio
@@ -16,12 +15,6 @@ from src.const import ReplyTexts
 from classes.player_provider import PlayerProvider
 
 
-class EmptyTrack(Playable):
-    def __init__(self):
-        info = {'title': 'Сейчас ничего не играет'}
-        super().__init__('-1', info)
-
-
 class PlayerWrapper:
     def __init__(self, player: FFMPEGPlayer, ):
         self._player = player
@@ -44,9 +37,24 @@ class PlayerView:
         self._player_wrapper: PlayerWrapper = PlayerWrapper(player)
         player.on_track_ended_callback = self.refresh_async
         self.timeout = None
-        self.message = None
+        self._message = None
         self.construct()
 
+    @property
+    def message(self):
+        return self._message
+
+    @message.setter
+    def message(self, message):
+        # render state is kept per message, a message that is no longer edited must not keep it forever
+        if self._message is not None and (message is None or message.id != self._message.id):
+            renderer.forget(self._message.id)
+        self._message = message
+
+    def forget(self):
+        if self._message is not None:
+            renderer.forget(self._message.id)
+
     def get_view(self) -> View:
         return self._view
 
@@ -96,8 +104,24 @@ class PlayerView:
         self.construct_view()
         self.construct_embed()
 
+    def render_state(self) -> tuple:
+        player = self._player_wrapper._player
+        data = self._player_wrapper.source_data
+        track = (data.title, data.author, data.photo) if data else None
+        return track, player.is_paused(), tuple(f.key for f in player.filters)
+
+    async def _edit_message(self):
+        self.construct(self._player_wrapper)
+        await self.message.edit(view=self._view, embed=self._embed)
+
+    def schedule_refresh(self):
+        if self.message is None:
+            return
+        renderer.schedule(self.message.id, self.render_state, self._edit_message)
+
     def refresh_async(self):
-        pass
+        # called from the audio thread when a track ends or the next one is handed over
+        self._player_wrapper._player.loop.call_soon_threadsafe(self.schedule_refresh)
 
     def get_vk_user_button(self):
         btn = Button()
@@ -171,11 +195,12 @@ class PlayerView:
         if not self._player_wrapper:
             player = await PlayerProvider.from_context(interaction)
             self._player_wrapper = PlayerWrapper(player)
-        self.construct(self._player_wrapper)
-        await self.message.edit(view=self._view, embed=self._embed)
+        self.schedule_refresh()
 
     async def filter_callback(self, interaction: Interaction, _filter: AudioFilter, force=False):
         player = await PlayerProvider.from_context(interaction)
+        if player is None:
+            return
         if _filter not in player.filters:
             player.filters.append(_filter)
             player.set_filters(*player.filters)
@@ -206,7 +231,9 @@ class PlayerView:
 
         async def callback(i: Interaction):
             player = await PlayerProvider.from_context(i)
-            player.queue.track_list.clear()
+            if player is None:
+                return
+            player.clear_queue()
             await i.response.defer()
             await self.refresh_self(i)
 
@@ -237,6 +264,8 @@ class PlayerView:
 
     async def pp_button_callback(self, interaction: Interaction):
         player = await PlayerProvider.from_context(interaction)
+        if player is None:
+            return
         player.play_or_pause()
         await self.refresh_self(interaction)
         await interaction.response.defer()
@@ -251,6 +280,8 @@ class PlayerView:
 
     async def next_button_callback(self, interaction: Interaction):
         player = await PlayerProvider.from_context(interaction)
+        if player is None:
+            return
         player.next_track()
         await self.refresh_self(interaction)
         await interaction.response.defer()
@@ -265,6 +296,8 @@ class PlayerView:
 
     async def prev_button_callback(self, interaction: Interaction):
         player = await PlayerProvider.from_context(interaction)
+        if player is None:
+            return
         player.prev_track()
         await self.refresh_self(interaction)
         await interaction.response.defer()
@@ -279,6 +312,8 @@ class PlayerView:
 
     async def shuffle_button_callback(self, interaction: Interaction):
         player = await PlayerProvider.from_context(interaction)
+        if player is None:
+            return
         player.shuffle()
         await self.refresh_self(interaction)
         await interaction.response.defer()
@@ -19,5 +19,11 @@ class MusicControl(MusicControllerCog):
     @slash_command(name='player')
     async def player(self, ctx: ApplicationContext):
         c = await PlayerProvider.from_context(ctx)
+        if c is None:
+            return
         view = PlayerView(c)
-        await ctx.respond(view=view.get_view(), embed=view.get_embed())
+        if c.view is not None:
+            # the new message takes over, the old one is not refreshed anymore
+            c.view.forget()
+        view.message = await ctx.respond(view=view.get_view(), embed=view.get_embed())
+        c.view = view
@@ -1,25 +1,87 @@
+import asyncio
+import re
 from enum import Enum
-from typing import Union
+from typing import Union, AsyncIterator, Optional
 
 from discord import ApplicationContext, Interaction
 
+from classes import tracing
+from classes.player import FFMPEGPlayer
 from classes.player_provider import PlayerProvider
-from classes.source_managers.vk_manager import VkSourceManager
+from classes.resolver import resolver, ResolveTimeout
+from classes.source_managers.registry import sources
+from classes.source_managers.source_manager import SourceManager, SourceError
+from classes.source_managers.track_ref import TrackRef
+from src.const import ErrorTexts
 
 
 class VkPlayer:
 
-    vk_searcher = VkSourceManager()
+    _imports: set[asyncio.Task] = set()
+    # the only link forms VkApi.iter_playlist_audio can take owner and playlist ids from
+    PLAYLIST_LINK = re.compile(r'(?:audio_playlist|album/)-?\d+_\d+')
 
     class PlayType(Enum):
         USER = 0
         PLAYLIST = 1
 
+    @staticmethod
+    async def vk_searcher() -> SourceManager:
+        if sources.loaded('vk'):
+            return sources.get('vk')
+        # the first use imports the vk manager and aiohttp, which is kept off the event loop
+        return await resolver.run('vk', sources.get, 'vk')
+
+    async def _next_page(self, pages: AsyncIterator[list[TrackRef]]) -> Optional[list[TrackRef]]:
+        try:
+            return await resolver.wait('vk', pages.__anext__())
+        except StopAsyncIteration:
+            return None
+
+    async def _fill_queue(self, player: FFMPEGPlayer, pages: AsyncIterator[list[TrackRef]]):
+        tracing.detach()
+        try:
+            while player.is_connected():
+                page = await self._next_page(pages)
+                if page is None:
+                    return
+                player.add_to_queue(*page)
+        except (ResolveTimeout, SourceError) as e:
+            print(e)
+        finally:
+            await pages.aclose()
+
     async def play(self, ctx: Union[ApplicationContext, Interaction], play_type: PlayType, q: str, ):
-        tracks = []
+        with tracing.trace('vk.play', query=q, play_type=play_type.name, guild=ctx.guild_id):
+            await self._play(ctx, play_type, q)
+
+    async def _play(self, ctx: Union[ApplicationContext, Interaction], play_type: PlayType, q: str):
+        pages = None
+        try:
+            vk_searcher = await self.vk_searcher()
+        except ResolveTimeout:
+            await ctx.respond(content=ErrorTexts.RESOLVE_TIMEOUT)
+            return
         if play_type == self.PlayType.USER:
-            tracks = self.vk_searcher.get_user(q).tracks
+            pages = vk_searcher.iter_user(q)
         if play_type == self.PlayType.PLAYLIST:
-            tracks = self.vk_searcher.get_playlist(q).tracks
+            pages = vk_searcher.iter_playlist(q)
+        if pages is None:
+            return
+        try:
+            first_page = await self._next_page(pages)
+        except ResolveTimeout:
+            await ctx.respond(content=ErrorTexts.RESOLVE_TIMEOUT)
+            return
+        except SourceError as e:
+            print(e)
+            return
         player = await PlayerProvider.from_context(ctx)
-        player.add_to_queue(*tracks, start_playing=True)
+        if first_page is None or player is None:
+            await pages.aclose()
+            return
+        player.add_to_queue(*first_page, start_playing=True)
+        # the rest of the library is paged in while the first track is already playing
+        task = asyncio.create_task(self._fill_queue(player, pages))
+        self._imports.add(task)
+        task.add_done_callback(self._imports.discard)
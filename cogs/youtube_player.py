@@ -2,28 +2,43 @@ import json
 from typing import Optional, Union
 
 from discord import slash_command, ApplicationContext, Interaction
-from wavelink import Track, YouTubeTrack, YouTubePlaylist
 
+from classes import tracing
 from classes.player_provider import PlayerProvider
-from classes.source_managers.ffmpeg_audio import PlayableAudio
-from classes.source_managers.youtube_manager import YoutubeSourceManager
+from classes.resolver import resolver
+from classes.source_managers.registry import sources
+from classes.source_managers.track_ref import TrackRef
+from cogs.vk import VkPlayer
+from src.const import ErrorTexts
 
 
 class YoutubePlayer:
 
     @staticmethod
-    async def _get_track(q: str, return_first: bool = True) -> Optional[list[PlayableAudio]]:
+    async def _get_track(q: str, return_first: bool = True) -> Optional[list[TrackRef]]:
         if len(q) == 0:
             return None
         try:
-            track = YoutubeSourceManager.get_track(q)
+            track = await resolver.run('youtube', sources.call, 'youtube', 'get_track', q)
             song_s = [track]
         except Exception as e:
             print(e)
-            song_s = (await YouTubePlaylist.search(query=q)).tracks
+            from wavelink import YouTubePlaylist
+            with tracing.span('youtube.playlist_search'):
+                song_s = (await YouTubePlaylist.search(query=q)).tracks
         return song_s
 
     async def play(self, ctx: Union[ApplicationContext, Interaction], query: str):
-        track = await self._get_track(query)
-        player = await PlayerProvider.from_context(ctx)
-        player.add_to_queue(*track, start_playing=True)
\ No newline at end of file
+        if sources.route(query) == 'vk':
+            # a pasted vk playlist link is handed over instead of being searched on youtube
+            if VkPlayer.PLAYLIST_LINK.search(query) is None:
+                await ctx.respond(content=ErrorTexts.VK_LINK_NOT_PLAYLIST)
+                return
+            await VkPlayer().play(ctx, VkPlayer.PlayType.PLAYLIST, query)
+            return
+        with tracing.trace('youtube.play', query=query, guild=ctx.guild_id):
+            track = await self._get_track(query)
+            player = await PlayerProvider.from_context(ctx)
+            if player is None or not track:
+                return
+            player.add_to_queue(*track, start_playing=True)
\ No newline at end of file
@@ -1,10 +1,16 @@
-from discord.ext import commands
-import discord
-import wavelink
-from cogs.youtube_player import YoutubePlayer
-from cogs.vk import VkPlayer
-from cogs.music_control import MusicControl
-import cogs.music_base
+import asyncio
+import time
+
+started = time.perf_counter()
+
+from discord.ext import commands  # noqa: E402
+import discord  # noqa: E402
+from cogs.music_control import MusicControl  # noqa: E402
+from classes.metrics import start_http_server  # noqa: E402
+from classes.source_managers.registry import sources  # noqa: E402
+from src.const import Constants  # noqa: E402
+
+imported = time.perf_counter() - started
 
 intents = discord.Intents.default()
 intents.message_content = True
@@ -17,6 +23,15 @@ bot.add_cog(MusicControl())
 @bot.event
 async def on_ready():
     print(f'We have logged in as {bot.user}')
+    print(f'Imports took {imported:.2f}s, ready after {time.perf_counter() - started:.2f}s')
+    # source managers are imported lazily, warming them now keeps that off the first command
+    await asyncio.to_thread(sources.preload().join)
+    print('Source manager imports: ' + ', '.join(f'{name} {seconds:.2f}s'
+                                                 for name, seconds in sources.timings.items() if seconds is not None))
+
+
+if Constants.METRICS_PORT:
+    start_http_server()
 
 
 # bot.add_cog(cogs.vk_cog.VkCog())
@@ -1,4 +1,7 @@
-from wavelink import Track, Player
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from wavelink import Track, Player
 
 
 class Constants:
@@ -9,11 +12,95 @@ class Constants:
 
     VK_TOKEN = ''
 
+    RESOLVER_WORKERS = 16
+    RESOLVER_TIMEOUT = 20
+    RESOLVER_DEFAULT_LIMIT = 4
+    RESOLVER_LIMITS = {'youtube': 8, 'vk': 4}
+
+    RESOLVE_CACHE_SIZE = 2048
+    RESOLVE_CACHE_PATH = None  # e.g. 'cache/resolve' to keep resolved tracks between restarts
+    RESOLVE_CACHE_EXPIRY_MARGIN = 300
+    YOUTUBE_STREAM_TTL = 5 * 60 * 60
+    VK_STREAM_TTL = 60 * 60
+    VK_PAGE_SIZE = 200
+
+    VK_API_URL = 'https://api.vk.com/method'
+    VK_API_CONCURRENCY = 4
+    VK_API_RATE = 3  # requests per second allowed for a user token
+    VK_API_RETRIES = 4
+    VK_API_BACKOFF = 0.5
+    VK_API_TIMEOUT = 15
+    VK_API_KEEPALIVE = 60
+
+    QUEUE_HISTORY_SIZE = 500
+
+    DEFAULT_SAMPLE_RATE = 48000
+    VK_SAMPLE_RATE = 44100
+    FILTER_GRAPH_CACHE_SIZE = 256
+
+    PREFETCH_SECONDS = 5
+    PREFETCH_DEPTH = 1
+
+    READ_AHEAD_SECONDS = 2  # 0 reads ffmpeg's stdout directly on the audio thread
+    READ_AHEAD_START_TIMEOUT = 10
+
+    AUDIO_OUTPUT = 'pcm'  # 'opus' lets ffmpeg encode (or copy) opus instead of encoding pcm in python
+    OPUS_BITRATE = 128
+    OPUS_MAX_BITRATE = 384
+    OPUS_COMPLEXITY = 10
+
+    AUDIO_CACHE_DIR = 'cache/audio'  # None disables the local audio cache
+    AUDIO_CACHE_MAX_BYTES = 2 * 1024 ** 3
+    AUDIO_CACHE_FORMAT = 'src'  # 'pcm' stores decoded audio which is memory-mapped for instant seeks
+    AUDIO_CACHE_WORKERS = 2
+    AUDIO_CACHE_TIMEOUT = 600
+
+    LOUDNESS_TARGET = -14  # LUFS, None disables loudness normalization
+    LOUDNESS_TRUE_PEAK = -1
+    LOUDNESS_MAX_GAIN = 12
+    LOUDNESS_INDEX_PATH = 'cache/loudness'  # None keeps measurements in memory only
+    LOUDNESS_WORKERS = 1
+    LOUDNESS_TIMEOUT = 300
+
+    BROADCAST = False  # players of the same input, offset and filters share one decoder
+    BROADCAST_OFFSET_BUCKET = 5
+    BROADCAST_LAG_SECONDS = 10  # how far a listener may fall behind the one furthest ahead before it detaches
+
+    FFMPEG_MAX_PROCESSES = 64
+    FFMPEG_TERMINATE_GRACE = 2
+    FFMPEG_SPAWN_TIMEOUT = 5
+
+    AUDIO_WORKERS = 0  # > 0 moves decoding, filters and opus encoding into that many worker processes
+    AUDIO_WORKER_BUFFER_FRAMES = 50
+
+    RENDER_INTERVAL = 1.5
+    RENDER_GLOBAL_RATE = 4
+    RENDER_GLOBAL_BURST = 5
+
+    PLAYER_IDLE_TIMEOUT = 300
+    PLAYER_REAP_INTERVAL = 30
+
+    STREAM_REFRESH_WINDOW = 15 * 60  # queued tracks starting within this many seconds are kept fresh
+    STREAM_REFRESH_INTERVAL = 60
+    STREAM_REFRESH_MARGIN = 120
+    STREAM_REFRESH_SCAN = 200
+    STREAM_MAX_REFRESHES = 3  # re-resolves of one playing track after its url expired mid-stream
+
+    METRICS_HOST = '127.0.0.1'
+    METRICS_PORT = 9108  # None disables the /metrics endpoint
+
+    TRACE_BUFFER_SIZE = 256
+    TRACE_PATH = None  # e.g. 'cache/traces.jsonl' to keep every finished trace
+    TRACE_SLOW_SECONDS = 3
+
 
 class ErrorTexts:
     NOT_CONNECTED_TO_VOICE = 'Вы не подключены к голосовому каналу'
     GET_VOICE_FAILED = 'Не удалось получить информацию о голосовом канале'
     QUEUE_IS_FULL = 'В очереди уже максимальное колличество треков'
+    RESOLVE_TIMEOUT = 'Не удалось найти трек: источник не ответил вовремя'
+    CONNECT_FAILED = 'Не удалось подключиться к голосовому каналу'
+    VK_LINK_NOT_PLAYLIST = 'Из ВКонтакте можно добавить только ссылку на плейлист или альбом'
 
 
 class ReplyTexts:
@@ -21,7 +108,7 @@ class ReplyTexts:
     AUTHOR = 'Автор'
 
     @staticmethod
-    def track_added(track: Track):
+    def track_added(track: 'Track'):
         return f'{ReplyTexts.lined(track.title)} добавлен в очередь'
 
     @staticmethod
@@ -33,7 +120,7 @@ class ReplyTexts:
         return f'Установлена громкость {ReplyTexts.lined(str(val) + "%")}'
 
     @staticmethod
-    def now_playing(player: Player):
+    def now_playing(player: 'Player'):
         now_playing = player.track.title if player.track is not None else 'ничего'
         return f'{ReplyTexts.NOW_PLAYING} {ReplyTexts.lined(now_playing)}'
 